@@ -1,17 +1,187 @@
+from collections import deque, namedtuple
+from fractions import Fraction
+from functools import lru_cache
+
 import numpy as np
-from scipy.signal import butter, filtfilt
+from scipy.signal import (
+    butter,
+    filtfilt,
+    firwin,
+    get_window,
+    resample_poly,
+    sosfilt,
+    sosfilt_zi,
+)
+from scipy.signal.windows import dpss
+
+from backend.instrument import count, instrumented, timed
+from backend.lsl import get_eeg, get_health, get_raw_eeg, get_stream_rate
+
+ALPHA_BAND = (8.0, 12.0)
+BETA_BAND = (13.0, 30.0)
+THETA_BAND = (4.0, 8.0)
+DELTA_BAND = (0.5, 4.0)
+BANDS = (ALPHA_BAND, BETA_BAND, THETA_BAND, DELTA_BAND)
+
+# One StreamingBAI update: the (value, state) pair shown in the UI, the
+# newest epoch's alpha/beta/theta/delta powers, combined like the BAI, and
+# the window mean of any extra metrics by name
+BAIUpdate = namedtuple(
+    "BAIUpdate", ["value", "state", "band_powers", "metrics"], defaults=(None,)
+)
+
+"""
+Everything the pipeline needs for one configuration, computed once.
+
+Holds the Butterworth coefficients (b/a for filtfilt, second-order
+sections and their initial state for streaming), the rFFT frequency bins
+of an epoch, a contiguous slice of bins per band, the band averaging
+weights and an optional window function. None of these change during a
+session, so the hot path only looks them up.
+
+estimator picks the spectral estimate used for band powers:
+"periodogram" (one FFT per epoch, the default), "welch" (averaged Hann
+segments of welch_segment_s with welch_overlap) or "multitaper" (averaged
+DPSS tapers with time-bandwidth multitaper_nw). Welch and multitaper
+estimates are scaled to the periodogram's units so scores stay comparable.
+
+dtype is the precision of the spectral stage. np.float32 halves the
+memory of every epoch, spectrum and band-power buffer and runs the FFT in
+complex64; the tapers and band weights are cast once here so nothing is
+upcast in the hot path.
+"""
+
+
+class AnalysisPlan:
+    def __init__(
+        self,
+        fs,
+        epoch_length_s=1.0,
+        bands=BANDS,
+        lowcut=0.5,
+        highcut=50.0,
+        order=5,
+        window=None,
+        estimator="periodogram",
+        welch_segment_s=0.5,
+        welch_overlap=0.5,
+        multitaper_nw=2.0,
+        dtype=np.float64,
+    ):
+        self.fs = fs
+        self.epoch_length_s = epoch_length_s
+        self.n_epoch = int(epoch_length_s * fs)
+        self.bands = bands
+        self.lowcut = lowcut
+        self.highcut = highcut
+        self.order = order
+
+        self.b, self.a = butter_bandpass(lowcut, highcut, fs, order)
+        self.sos = butter_bandpass_sos(lowcut, highcut, fs, order)
+        self.sos_zi = sosfilt_zi(self.sos)
+
+        self.freqs = np.fft.rfftfreq(self.n_epoch, 1.0 / fs)
+        self.band_slices = {}
+        for low, high in bands:
+            idx = np.flatnonzero((self.freqs >= low) & (self.freqs <= high))
+            start = int(idx[0]) if len(idx) else 0
+            self.band_slices[(low, high)] = slice(start, start + len(idx))
+        self.band_weights = band_weights(self.n_epoch, fs, bands)
+        self.window = None if window is None else get_window(window, self.n_epoch)
+
+        self.estimator = estimator
+        if estimator == "welch":
+            self.n_segment = min(self.n_epoch, int(welch_segment_s * fs))
+            self.segment_step = max(
+                1, self.n_segment - int(welch_overlap * self.n_segment)
+            )
+            self.taper = get_window("hann", self.n_segment)
+            # A white-noise periodogram of the epoch has mean n_epoch * var
+            self.scale = self.n_epoch / np.sum(self.taper**2)
+            self.spectrum_weights = band_weights(self.n_segment, fs, bands)
+            self.spectrum_freqs = np.fft.rfftfreq(self.n_segment, 1.0 / fs)
+        elif estimator == "multitaper":
+            n_tapers = max(1, int(2 * multitaper_nw) - 1)
+            # (n_tapers, n_epoch), each taper with unit energy
+            self.taper = dpss(self.n_epoch, multitaper_nw, n_tapers)
+            self.scale = self.n_epoch
+            self.spectrum_weights = self.band_weights
+            self.spectrum_freqs = self.freqs
+        elif estimator == "periodogram":
+            self.taper = self.window
+            self.scale = 1.0
+            self.spectrum_weights = self.band_weights
+            self.spectrum_freqs = self.freqs
+        else:
+            raise ValueError(f"Unknown spectral estimator: {estimator}")
+
+        self.dtype = np.dtype(dtype)
+        if self.taper is not None:
+            self.taper = self.taper.astype(self.dtype, copy=False)
+        self.spectrum_weights = self.spectrum_weights.astype(self.dtype, copy=False)
+
+
+"""
+Get the AnalysisPlan for a configuration, reusing one of the most
+recently used plans when the configuration matches.
+"""
+
+
+@lru_cache(maxsize=8)
+def get_plan(
+    fs,
+    epoch_length_s=1.0,
+    bands=BANDS,
+    lowcut=0.5,
+    highcut=50.0,
+    order=5,
+    window=None,
+    estimator="periodogram",
+    welch_segment_s=0.5,
+    welch_overlap=0.5,
+    multitaper_nw=2.0,
+    dtype=np.float64,
+):
+    return AnalysisPlan(
+        fs,
+        epoch_length_s,
+        bands,
+        lowcut,
+        highcut,
+        order,
+        window,
+        estimator,
+        welch_segment_s,
+        welch_overlap,
+        multitaper_nw,
+        dtype,
+    )
 
-from backend.lsl import get_raw_eeg
 
 """
-Filter the input data using a bandpass filter and filtfilt.
+Filter the input data using a bandpass filter.
+
+mode="offline" runs zero-phase filtfilt over the whole buffer and is meant
+for complete recordings. mode="causal" runs the same filter forward only,
+as a StreamingFilter would over the same samples. A plan supplies the
+filter instead of lowcut/highcut/order.
 """
 
 
-def apply_filter(data, fs, lowcut=0.5, highcut=50.0, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    # filtfilt applies the filter forward and backward
-    filtered_data = filtfilt(b, a, data, axis=-1)
+@instrumented("apply_filter")
+def apply_filter(
+    data, fs, lowcut=0.5, highcut=50.0, order=5, mode="offline", plan=None
+):
+    if plan is None:
+        plan = get_plan(fs, lowcut=lowcut, highcut=highcut, order=order)
+
+    if mode == "offline":
+        # filtfilt applies the filter forward and backward
+        filtered_data = filtfilt(plan.b, plan.a, data, axis=-1)
+    elif mode == "causal":
+        filtered_data = StreamingFilter(fs, plan=plan).process(data)
+    else:
+        raise ValueError(f"Unknown filter mode: {mode}")
     return filtered_data
 
 
@@ -20,6 +190,7 @@ Create a Butterworth bandpass filter.
 """
 
 
+@lru_cache(maxsize=16)
 def butter_bandpass(lowcut, highcut, fs, order=5):
     nyquist = 0.5 * fs
     low = lowcut / nyquist
@@ -28,39 +199,253 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
     return b, a
 
 
+"""
+Create a Butterworth bandpass filter as second-order sections.
+"""
+
+
+@lru_cache(maxsize=16)
+def butter_bandpass_sos(lowcut, highcut, fs, order=5):
+    nyquist = 0.5 * fs
+    low = lowcut / nyquist
+    high = highcut / nyquist
+    return butter(order, [low, high], btype="band", output="sos")
+
+
+"""
+Rational up/down factors taking fs_in to fs_out.
+"""
+
+
+def resample_factors(fs_in, fs_out):
+    ratio = Fraction(fs_out / fs_in).limit_denominator(1000)
+    return ratio.numerator, ratio.denominator
+
+
+"""
+Resample a whole signal from fs_in to fs_out along the last axis with a
+polyphase anti-aliasing filter (for offline use).
+"""
+
+
+def resample(data, fs_in, fs_out):
+    up, down = resample_factors(fs_in, fs_out)
+    if up == down:
+        return np.asarray(data, dtype=float)
+    return resample_poly(data, up, down, axis=-1)
+
+
+"""
+Causal polyphase resampler for real-time use.
+
+Brings a stream from fs_in down (or up) to fs_out through the same
+Kaiser-windowed anti-aliasing FIR as scipy's resample_poly, split into
+one short filter per output phase so only the output samples that are
+kept are computed. The last input samples are carried between chunks, so
+the concatenated output does not depend on how the stream was chunked;
+the history starts filled with the first sample to avoid a start-up
+transient. Being causal, the output lags the input by the filter's group
+delay, half_len output samples when downsampling (about 40 ms at 256 Hz).
+Equal rates pass through untouched.
+"""
+
+
+class StreamingResampler:
+    def __init__(self, fs_in, fs_out, half_len=10):
+        self.fs_in = fs_in
+        self.fs_out = fs_out
+        self.up, self.down = resample_factors(fs_in, fs_out)
+        self.reset()
+        if self.up == self.down:
+            return
+        max_rate = max(self.up, self.down)
+        n_taps = 2 * half_len * max_rate + 1
+        taps = firwin(n_taps, 1.0 / max_rate, window=("kaiser", 5.0)) * self.up
+        # bank[p, j] = taps[p + up * j]: the taps that meet input samples at phase p
+        self.n_phase_taps = -(-n_taps // self.up)
+        taps = np.concatenate((taps, np.zeros(self.n_phase_taps * self.up - n_taps)))
+        self.bank = taps.reshape(self.n_phase_taps, self.up).T[:, ::-1]
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=float)
+        if self.up == self.down:
+            return chunk
+        if chunk.shape[-1] == 0:
+            return chunk.copy()
+        if self._history is None:
+            self._history = np.repeat(chunk[..., :1], self.n_phase_taps - 1, axis=-1)
+
+        x = np.concatenate((self._history, chunk), axis=-1)
+        first = self._received - self._history.shape[-1]  # Input index of x[..., 0]
+        self._received += chunk.shape[-1]
+
+        # Output m needs inputs up to (m * down) // up
+        end = (self._received * self.up - 1) // self.down + 1
+        m = np.arange(self._next_out, end)
+        self._next_out = end
+        newest = (m * self.down) // self.up - first
+        indices = newest[:, None] + np.arange(1 - self.n_phase_taps, 1)
+        phase_taps = self.bank[(m * self.down) % self.up]
+        out = np.einsum("...mk,mk->...m", x[..., indices], phase_taps)
+
+        self._history = x[..., x.shape[-1] - (self.n_phase_taps - 1) :]
+        return out
+
+    def reset(self):
+        self._history = None
+        self._received = 0
+        self._next_out = 0
+
+
+"""
+Causal bandpass filter for real-time use.
+
+The second-order sections are designed once and the filter state is
+carried from one chunk to the next, so each chunk costs O(len(chunk)) and
+the concatenated output equals filtering the whole stream at once. Chunks
+are 1-D or (channels, samples); the state is initialized from the first
+sample of the first chunk to avoid a start-up transient. A plan supplies
+the filter instead of lowcut/highcut/order.
+"""
+
+
+class StreamingFilter:
+    def __init__(self, fs, lowcut=0.5, highcut=50.0, order=5, plan=None):
+        if plan is None:
+            plan = get_plan(fs, lowcut=lowcut, highcut=highcut, order=order)
+        self.sos = plan.sos
+        self.sos_zi = plan.sos_zi
+        self._zi = None
+
+    @instrumented("streaming_filter")
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.shape[-1] == 0:
+            return chunk
+        if self._zi is None:
+            zi = self.sos_zi.reshape((len(self.sos),) + (1,) * (chunk.ndim - 1) + (2,))
+            self._zi = zi * chunk[..., :1]
+        filtered, self._zi = sosfilt(self.sos, chunk, axis=-1, zi=self._zi)
+        return filtered
+
+    def reset(self):
+        self._zi = None
+
+
 """
 Segment continuous data into epochs.
+
+Returns a (..., n_epochs, n_samples_per_epoch) view of the data, so a 1-D
+signal becomes (n_epochs, n_samples_per_epoch) without copying. Trailing
+samples that do not fill an epoch are dropped. With a plan, fs and
+epoch_length_s may be None.
 """
 
 
-def segment_epochs(data, fs, epoch_length_s):
-    n_samples_per_epoch = int(epoch_length_s * fs)
+def segment_epochs(data, fs, epoch_length_s, plan=None):
+    if plan is None:
+        n_samples_per_epoch = int(epoch_length_s * fs)
+    else:
+        n_samples_per_epoch = plan.n_epoch
     n_total_samples = data.shape[-1]
     n_epochs = n_total_samples // n_samples_per_epoch
 
-    epochs = []
-    for i in range(n_epochs):
-        start = i * n_samples_per_epoch
-        end = start + n_samples_per_epoch
-        if data.ndim == 1:
-            epoch_data = data[start:end]
-        else:
-            epoch_data = data[:, start:end]
-        epochs.append(epoch_data)
-    return epochs
+    usable = data[..., : n_epochs * n_samples_per_epoch]
+    return usable.reshape(data.shape[:-1] + (n_epochs, n_samples_per_epoch))
+
+
+"""
+Per-epoch artifact detector, run on filtered epochs.
+
+An epoch is flagged when any enabled test fails: peak-to-peak amplitude
+above amplitude (blinks, electrode pops), excess kurtosis above kurtosis
+(isolated spikes), mean absolute first difference above line_length
+(sharp transients), or a share of power above emg_hz (jaw and muscle
+EMG) above emg_ratio. The first three run on the samples before the FFT,
+so those epochs are never transformed; the EMG share is read from the
+band-power stage's own spectrum afterwards (reject_spectrum), so no epoch
+is transformed twice. emg_hz sits far enough above the 30 Hz edge of the
+beta band that no estimator leaks a beta rhythm past it. Thresholds are
+in the stream's units (uV for Muse); None disables a test. Every test is vectorized over (..., n_epochs, n).
+"""
+
+
+class ArtifactDetector:
+    def __init__(
+        self,
+        amplitude=150.0,
+        kurtosis=5.0,
+        line_length=None,
+        emg_ratio=0.15,
+        emg_hz=32.0,
+    ):
+        self.amplitude = amplitude
+        self.kurtosis = kurtosis
+        self.line_length = line_length
+        self.emg_ratio = emg_ratio
+        self.emg_hz = emg_hz
+
+    # Boolean (..., n_epochs) mask of epochs flagged by the sample tests,
+    # per channel
+    def __call__(self, epochs):
+        bad = np.zeros(epochs.shape[:-1], dtype=bool)
+        if self.amplitude is not None:
+            bad |= np.ptp(epochs, axis=-1) > self.amplitude
+        if self.kurtosis is not None:
+            # Squared deviations, computed once for both moments
+            squared = epochs - np.mean(epochs, axis=-1, keepdims=True)
+            np.square(squared, out=squared)
+            n = epochs.shape[-1]
+            variance = np.sum(squared, axis=-1) / n
+            fourth = np.einsum("...i,...i->...", squared, squared) / n
+            with np.errstate(divide="ignore", invalid="ignore"):
+                bad |= fourth / variance**2 - 3 > self.kurtosis
+        if self.line_length is not None:
+            bad |= np.mean(np.abs(np.diff(epochs, axis=-1)), axis=-1) > self.line_length
+        return bad
+
+    # Boolean (..., n_epochs) mask of EMG epochs, per channel, from their
+    # (..., n_epochs, n_freqs) power spectra at freqs
+    def emg(self, power, freqs):
+        if self.emg_ratio is None:
+            return np.zeros(power.shape[:-1], dtype=bool)
+        high = np.sum(power[..., freqs > self.emg_hz], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return high / np.sum(power, axis=-1) > self.emg_ratio
+
+    # (n_epochs,) mask of epochs flagged by the sample tests in any channel
+    def reject(self, epochs):
+        return _any_channel(self(epochs))
+
+    # (n_epochs,) mask of epochs whose spectra show EMG in any channel
+    def reject_spectrum(self, power, freqs):
+        return _any_channel(self.emg(power, freqs))
+
+
+def _any_channel(bad):
+    return bad.reshape(-1, bad.shape[-1]).any(axis=0)
 
 
 """
 Compute power spectrum for a single epoch using FFT.
+
+A plan whose epoch length matches supplies the frequency bins and its
+window, if any.
 """
 
 
-def compute_power_spectrum(epoch_data, fs):
+def compute_power_spectrum(epoch_data, fs, plan=None):
     if epoch_data.ndim == 2:
         epoch_data = np.mean(epoch_data, axis=0)
 
-    fft_vals = np.fft.rfft(epoch_data)
-    fft_freqs = np.fft.rfftfreq(len(epoch_data), 1.0 / fs)
+    if plan is not None and plan.n_epoch == len(epoch_data):
+        if plan.window is not None:
+            epoch_data = epoch_data * plan.window
+        fft_vals = np.fft.rfft(epoch_data)
+        fft_freqs = plan.freqs
+    else:
+        fft_vals = np.fft.rfft(epoch_data)
+        fft_freqs = np.fft.rfftfreq(len(epoch_data), 1.0 / fs)
 
     psd = np.abs(fft_vals) ** 2
     return fft_freqs, psd
@@ -68,74 +453,235 @@ def compute_power_spectrum(epoch_data, fs):
 
 """
 Calculate average power in a specific frequency band.
+
+A plan whose bins match freqs supplies the band's precomputed slice.
 """
 
 
-def get_band_power(freqs, psd, band):
+def get_band_power(freqs, psd, band, plan=None):
+    if (
+        plan is not None
+        and len(freqs) == len(plan.freqs)
+        and tuple(band) in plan.band_slices
+    ):
+        band_slice = plan.band_slices[tuple(band)]
+        return np.mean(psd[band_slice]) if band_slice.stop > band_slice.start else 0
+
     idx = np.where((freqs >= band[0]) & (freqs <= band[1]))[0]
     band_power = np.mean(psd[idx]) if len(idx) > 0 else 0
     return band_power
 
 
+"""
+Averaging weights that turn a power spectrum into band powers.
+
+Column j of the (n_freqs, n_bands) matrix is 1/count over the rFFT bins
+inside bands[j] and 0 elsewhere, so psd @ weights gives the same mean as
+get_band_power for every band at once (0 for a band with no bins).
+"""
+
+
+@lru_cache(maxsize=16)
+def band_weights(n_samples, fs, bands=BANDS):
+    freqs = np.fft.rfftfreq(n_samples, 1.0 / fs)
+    masks = np.array([(freqs >= low) & (freqs <= high) for low, high in bands])
+    counts = masks.sum(axis=1)
+    weights = masks.T / np.maximum(counts, 1)
+    weights.flags.writeable = False
+    return weights
+
+
+"""
+Compute band powers for a batch of epochs with a single FFT.
+
+epochs has shape (..., n_samples); the result has shape (..., n_bands)
+with the bands in the order given (alpha, beta, theta, delta by default).
+A plan whose epoch length matches supplies the bands, their weights, its
+window and its spectral estimator.
+"""
+
+
+def compute_band_powers(epochs, fs, bands=BANDS, plan=None):
+    if plan is None or plan.n_epoch != epochs.shape[-1]:
+        psd = np.abs(np.fft.rfft(epochs, axis=-1)) ** 2
+        return psd @ band_weights(epochs.shape[-1], fs, bands)
+
+    # A fresh estimator's buffers belong to nobody else, so no copy is needed
+    return SpectralEstimator(plan).band_powers(epochs)
+
+
+"""
+Band powers from a plan's spectral estimator, for all epochs at once,
+computed in scratch buffers that are reused from one call to the next as
+long as the input shape stays the same.
+
+The returned array is the estimator's own output buffer and is
+overwritten by the next call; pass out= or copy it to keep the values.
+The power spectrum behind it stays in power, at plan.spectrum_freqs,
+until the next call too.
+"""
+
+
+class SpectralEstimator:
+    def __init__(self, plan):
+        self.plan = plan
+        self.power = None
+        self._shape = None
+
+    @instrumented("band_powers")
+    def band_powers(self, epochs, out=None):
+        plan = self.plan
+        if epochs.shape != self._shape:
+            self._allocate(epochs.shape)
+
+        if plan.estimator == "welch":
+            # (..., n_epochs, n_segments, n_segment) view of overlapping segments
+            frames = np.lib.stride_tricks.sliding_window_view(
+                epochs, plan.n_segment, axis=-1
+            )[..., :: plan.segment_step, :]
+            np.multiply(frames, plan.taper, out=self._tapered)
+        elif plan.estimator == "multitaper":
+            np.multiply(epochs[..., None, :], plan.taper, out=self._tapered)
+        elif plan.taper is not None:
+            np.multiply(epochs, plan.taper, out=self._tapered)
+        else:
+            self._tapered[...] = epochs
+
+        np.fft.rfft(self._tapered, axis=-1, out=self._spectrum)
+        np.abs(self._spectrum, out=self._power)
+        np.square(self._power, out=self._power)
+        power = self._power
+        if plan.estimator != "periodogram":
+            # Average over segments or tapers
+            power = np.mean(self._power, axis=-2, out=self._psd)
+            power *= plan.scale
+        self.power = power
+
+        if out is None:
+            out = self._out
+        return np.matmul(power, plan.spectrum_weights, out=out)
+
+    def _allocate(self, shape):
+        plan = self.plan
+        n_samples = shape[-1]
+        if plan.estimator == "welch":
+            n_segments = (n_samples - plan.n_segment) // plan.segment_step + 1
+            tapered_shape = shape[:-1] + (n_segments, plan.n_segment)
+        elif plan.estimator == "multitaper":
+            tapered_shape = shape[:-1] + plan.taper.shape
+        else:
+            tapered_shape = shape
+        spectrum_shape = tapered_shape[:-1] + (tapered_shape[-1] // 2 + 1,)
+
+        dtype = plan.dtype
+        self._tapered = np.empty(tapered_shape, dtype)
+        self._spectrum = np.empty(spectrum_shape, np.result_type(dtype, np.complex64))
+        self._power = np.empty(spectrum_shape, dtype)
+        self._psd = np.empty(spectrum_shape[:-2] + spectrum_shape[-1:], dtype)
+        self._out = np.empty(shape[:-1] + (len(plan.bands),), dtype)
+        self._shape = shape
+
+
+"""
+Indices computed from band powers, by name. A metric takes the alpha,
+beta, theta and delta series, each (..., n_epochs), and fs and returns a
+(..., n_epochs) series, so any set of metrics shares one spectral pass.
+"""
+
+METRICS = {}
+
+
+def register_metric(name):
+    def register(fn):
+        METRICS[name] = fn
+        return fn
+
+    return register
+
+
 """
 Compute BAI using series of alpha, beta, theta, and delta powers.
+
+The series may be (channels, epochs) matrices; derivatives are taken
+along axis. epoch_index gives each epoch's position when some epochs were
+left out, so derivatives span only the remaining neighbours.
 """
 
 
-def compute_bai(alpha_series, beta_series, theta_series, delta_series, fs):
+@register_metric("bai")
+@instrumented("compute_bai")
+def compute_bai(
+    alpha_series,
+    beta_series,
+    theta_series,
+    delta_series,
+    fs,
+    axis=-1,
+    epoch_index=None,
+):
     # Calculate derivatives (approximated by discrete differences)
     dt = 1.0 / fs
+    if epoch_index is not None:
+        dt = np.asarray(epoch_index) * dt
 
-    d_alpha = np.gradient(alpha_series, dt)
-    d_beta = np.gradient(beta_series, dt)
-    d_theta = np.gradient(theta_series, dt)
-    d_delta = np.gradient(delta_series, dt)
+    d_alpha = np.gradient(alpha_series, dt, axis=axis)
+    d_beta = np.gradient(beta_series, dt, axis=axis)
+    d_theta = np.gradient(theta_series, dt, axis=axis)
+    d_delta = np.gradient(delta_series, dt, axis=axis)
 
     bai_values = np.abs((d_alpha + d_theta) * d_delta - d_beta)
     return bai_values
 
 
 """
-Full pipeline: filter, epoch, power spectrum, then compute BAI state.
+Engagement index beta / (alpha + theta) (Pope et al., 1995).
 """
 
 
-def analyze_eeg(fs=256, epoch_length_s=1.0):
-    data = get_raw_eeg()
+@register_metric("engagement")
+def engagement_index(alpha_series, beta_series, theta_series, delta_series, fs):
+    return beta_series / (alpha_series + theta_series)
 
-    # Preprocessing
-    filtered_data = apply_filter(data, fs, lowcut=0.5, highcut=50.0, order=5)
-    epochs = segment_epochs(filtered_data, fs, epoch_length_s)
-
-    alpha_band = (8.0, 12.0)
-    beta_band = (13.0, 30.0)
-
-    alpha_series = []
-    beta_series = []
-    theta_series = []
-    delta_series = []
-
-    # Process each epoch
-    for epoch in epochs:
-        freqs, psd = compute_power_spectrum(epoch, fs)
-        alpha_power = get_band_power(freqs, psd, alpha_band)
-        beta_power = get_band_power(freqs, psd, beta_band)
-        theta_power = get_band_power(freqs, psd, (4.0, 8.0))
-        delta_power = get_band_power(freqs, psd, (0.5, 4.0))
-
-        alpha_series.append(alpha_power)
-        beta_series.append(beta_power)
-        theta_series.append(theta_power)
-        delta_series.append(delta_power)
-
-    alpha_series = np.array(alpha_series)
-    beta_series = np.array(beta_series)
-    theta_series = np.array(theta_series)
-    delta_series = np.array(delta_series)
 
-    bai_values = compute_bai(alpha_series, beta_series, theta_series, delta_series, fs)
-    mean_bai = np.mean(bai_values)
-    normalized_bai = min(1.0, max(0.0, mean_bai / 1e20))
+"""
+Alpha/beta power ratio.
+"""
+
+
+@register_metric("alpha_beta")
+def alpha_beta_ratio(alpha_series, beta_series, theta_series, delta_series, fs):
+    return alpha_series / beta_series
+
+
+"""
+Evaluate the named metrics on a (..., n_epochs, n_bands) band-power
+matrix, returning a dict of (..., n_epochs) series.
+"""
+
+
+def compute_metrics(band_powers, fs, metrics=("bai",)):
+    alpha_series, beta_series, theta_series, delta_series = np.moveaxis(
+        band_powers, -1, 0
+    )
+    return {
+        name: METRICS[name](alpha_series, beta_series, theta_series, delta_series, fs)
+        for name in metrics
+    }
+
+
+"""
+Map a mean BAI onto the 1-100 score and its focus state.
+
+With a ScoreNormalizer the BAI is scored against the user's own running
+statistics (and added to them); without one a fixed 1e20 divisor is used.
+"""
+
+
+def score_bai(mean_bai, normalizer=None, update=True):
+    if normalizer is None:
+        normalized_bai = min(1.0, max(0.0, mean_bai / 1e20))
+    else:
+        normalized_bai = normalizer.normalize(mean_bai, update)
     bai_score = round(1 + (normalized_bai * 99))
 
     if bai_score < 25:
@@ -147,4 +693,427 @@ def analyze_eeg(fs=256, epoch_length_s=1.0):
     else:
         focus_state = "Very High"
 
-    return (int(mean_bai), focus_state)
+    return bai_score, focus_state
+
+
+"""
+Turn a mean BAI into the (value, focus state) pair shown in the UI. A
+per-channel array of means gives a list of values and a list of states.
+With a normalizer the value is the 1-100 score rather than the raw BAI;
+per-channel values are all scored against the same statistics, which are
+then updated once with the channel mean.
+"""
+
+
+def bai_result(mean_bai, normalizer=None):
+    if np.ndim(mean_bai) == 0:
+        bai_score, focus_state = score_bai(mean_bai, normalizer)
+        if normalizer is not None:
+            return (bai_score, focus_state)
+        return (int(mean_bai), focus_state)
+
+    if normalizer is None:
+        values = [int(value) for value in mean_bai]
+        states = [score_bai(value)[1] for value in mean_bai]
+        return (values, states)
+
+    scores = [score_bai(value, normalizer, update=False) for value in mean_bai]
+    normalizer.update(np.mean(mean_bai))
+    return ([score for score, _ in scores], [state for _, state in scores])
+
+
+"""
+Combine per-channel values across channels (axis 0). method=None keeps
+the channels separate.
+"""
+
+
+def aggregate_channels(values, method="mean"):
+    if method is None or np.ndim(values) == 0:
+        return values
+    if method == "mean":
+        return np.mean(values, axis=0)
+    if method == "median":
+        return np.median(values, axis=0)
+    raise ValueError(f"Unknown channel aggregation: {method}")
+
+
+"""
+Filter, epoch and transform a signal, then compute BAI per epoch.
+
+data is 1-D or (channels, samples). Returns the BAI as (..., n_epochs)
+together with the band powers as (..., n_epochs, n_bands), so a
+multi-channel input gives a (channels x epochs) BAI matrix. With an
+ArtifactDetector as artifacts, epochs it flags are NaN in both results.
+"""
+
+
+def compute_channel_bai(
+    data, fs, epoch_length_s=1.0, mode="offline", plan=None, artifacts=None
+):
+    if plan is None:
+        plan = get_plan(fs, epoch_length_s)
+
+    # Preprocessing
+    filtered_data = apply_filter(data, fs, mode=mode, plan=plan)
+    epochs = segment_epochs(filtered_data, fs, epoch_length_s, plan=plan)
+
+    if artifacts is not None:
+        return _clean_channel_bai(epochs, fs, plan, artifacts)
+
+    # Band powers of every channel and epoch in one pass
+    band_powers = compute_band_powers(epochs, fs, plan=plan)
+    alpha_series, beta_series, theta_series, delta_series = np.moveaxis(
+        band_powers, -1, 0
+    )
+
+    bai_values = compute_bai(alpha_series, beta_series, theta_series, delta_series, fs)
+    return bai_values, band_powers
+
+
+# compute_channel_bai for the epochs the detector passes; the rest are NaN
+def _clean_channel_bai(epochs, fs, plan, artifacts):
+    good = np.flatnonzero(~artifacts.reject(epochs))
+    if len(good) >= 2:
+        # Only epochs that pass the sample tests reach the FFT, whose
+        # spectrum is then checked for EMG
+        estimator = SpectralEstimator(plan)
+        powers = estimator.band_powers(epochs[..., good, :])
+        clean = ~artifacts.reject_spectrum(estimator.power, plan.spectrum_freqs)
+        good, powers = good[clean], powers[..., clean, :]
+    count("rejected_epochs", epochs.shape[-2] - len(good))
+    band_powers = np.full(epochs.shape[:-1] + (len(plan.bands),), np.nan)
+    bai_values = np.full(epochs.shape[:-1], np.nan)
+    if len(good) < 2:
+        return bai_values, band_powers
+
+    band_powers[..., good, :] = powers
+    alpha_series, beta_series, theta_series, delta_series = np.moveaxis(powers, -1, 0)
+    bai_values[..., good] = compute_bai(
+        alpha_series, beta_series, theta_series, delta_series, fs, epoch_index=good
+    )
+    return bai_values, band_powers
+
+
+"""
+Full pipeline: filter, epoch, power spectrum, then compute BAI state.
+
+By default the AF7/AF8 average is analyzed as one signal. Passing channel
+names analyzes each channel separately; aggregate then combines the
+per-channel means ("mean", "median"), or None returns one value and state
+per channel. Without a plan the cached plan for (fs, epoch_length_s) is
+used. A ScoreNormalizer scores the result against per-user statistics.
+Data is acquired at the stream's own rate (or input_fs) and resampled to
+the analysis rate fs first.
+Returns None if the stream delivered less than two epochs of data.
+"""
+
+
+def analyze_eeg(
+    fs=256,
+    epoch_length_s=1.0,
+    channels=None,
+    aggregate="mean",
+    plan=None,
+    normalizer=None,
+    input_fs=None,
+    artifacts=None,
+):
+    input_fs = get_stream_rate(fs) if input_fs is None else input_fs
+    if channels is None:
+        data = get_raw_eeg(fs=input_fs)
+    else:
+        data = get_eeg(fs=input_fs, channels=channels)
+    data = resample(data, input_fs, fs)
+
+    if plan is None:
+        plan = get_plan(fs, epoch_length_s)
+    if data.shape[-1] < 2 * plan.n_epoch:
+        print("Warning: Not enough EEG data to analyze")
+        return None
+
+    bai_values, band_powers = compute_channel_bai(
+        data, fs, epoch_length_s, plan=plan, artifacts=artifacts
+    )
+    if np.isnan(bai_values).all():
+        print("Warning: Too few artifact-free epochs to analyze")
+        return None
+    mean_bai = aggregate_channels(np.nanmean(bai_values, axis=-1), aggregate)
+
+    return bai_result(mean_bai, normalizer)
+
+
+"""
+Incremental BAI over a rolling window of epochs.
+
+Every hop_s seconds the latest filtered epoch's band powers join a window
+of the last window_epochs epochs, and update() returns a BAIUpdate with the
+window's mean BAI, combined across channels with aggregate as in
+analyze_eeg and scored against normalizer if one is given. Epochs flagged
+by an ArtifactDetector as artifacts are left out of the window, and
+dtype=np.float32 keeps the buffers in single precision.
+"""
+
+
+class StreamingBAI:
+    def __init__(
+        self,
+        fs=256,
+        epoch_length_s=1.0,
+        hop_s=None,
+        window_epochs=10,
+        aggregate="mean",
+        plan=None,
+        normalizer=None,
+        metrics=(),
+        artifacts=None,
+        dtype=np.float64,
+    ):
+        self.fs = fs
+        if plan is None:
+            plan = get_plan(fs, epoch_length_s, dtype=dtype)
+        self.plan = plan
+        self.hop_s = epoch_length_s if hop_s is None else hop_s
+        self.n_epoch = self.plan.n_epoch
+        self.n_hop = int(self.hop_s * fs)
+        self.window_epochs = window_epochs
+        self.aggregate = aggregate
+        self.normalizer = normalizer
+        self.metrics = tuple(metrics)
+        self.artifacts = artifacts
+        self.rejected = 0
+
+        self._filter = StreamingFilter(fs, plan=self.plan)
+        self._estimator = SpectralEstimator(self.plan)
+
+        # Filtered samples live in _history[..., _start:_stop]
+        self._history = None
+        self._start = 0
+        self._stop = 0
+        self._pending = 0
+        # Window buffers, allocated on the first epoch; see _allocate_window
+        self._window = None
+        self._added = 0
+        # Positions of the epochs in the window, in hops since the start
+        self._indices = deque(maxlen=window_epochs)
+        self._due = deque()
+        self._n_epochs = 0
+
+    # Start over, e.g. after a break in the stream, keeping the buffers
+    def reset(self):
+        self._filter.reset()
+        self._start = self._stop = self._pending = 0
+        self._added = 0
+        self._indices.clear()
+        self._due.clear()
+
+    def update(self, samples):
+        results = []
+        with timed("epoch_loop"):
+            for epoch in self.epochs(samples):
+                band_powers = self._estimator.band_powers(epoch)
+                if self.reject_spectrum(self._estimator.power):
+                    continue
+                # add_band_powers copies out of the estimator's buffer
+                result = self.add_band_powers(band_powers)
+                if result is not None:
+                    results.append(result)
+        return results
+
+    # Drop the oldest due epoch if its (..., n_freqs) power spectrum, at the
+    # plan's spectrum_freqs, shows EMG; callers that transform the epochs
+    # themselves check each one here before add_band_powers
+    def reject_spectrum(self, power):
+        if (
+            self.artifacts is None
+            or not self.artifacts.reject_spectrum(
+                power[..., None, :], self.plan.spectrum_freqs
+            ).any()
+        ):
+            return False
+        self._due.popleft()
+        self.rejected += 1
+        count("rejected_epochs")
+        return True
+
+    # Filter new samples and return the epochs that became due, oldest first,
+    # as views that stay valid until the next call
+    def epochs(self, samples):
+        filtered = self._filter.process(samples)
+        self._append(filtered)
+        self._pending += filtered.shape[-1]
+
+        epochs = []
+        while self._pending >= self.n_hop:
+            self._pending -= self.n_hop
+            end = self._stop - self._pending
+            if end - self._start < self.n_epoch:
+                continue  # Not enough history yet for a full epoch
+            epoch = self._history[..., end - self.n_epoch : end]
+            self._n_epochs += 1
+            if self.artifacts is not None and self.artifacts.reject(
+                epoch[..., None, :]
+            ):
+                self.rejected += 1
+                count("rejected_epochs")
+                continue
+            epochs.append(epoch)
+            self._due.append(self._n_epochs)
+
+        self._start = max(self._start, self._stop - (self.n_epoch + self._pending))
+        return epochs
+
+    # Copy filtered samples into the history buffer, moving the samples still
+    # needed to the front when the buffer is full
+    def _append(self, filtered):
+        n = filtered.shape[-1]
+        kept = self._stop - self._start
+        if self._history is None or self._history.shape[:-1] != filtered.shape[:-1]:
+            self._history = np.empty(
+                filtered.shape[:-1] + (2 * (self.n_epoch + self.n_hop + n),),
+                self.plan.dtype,
+            )
+            self._start = self._stop = 0
+        elif self._stop + n > self._history.shape[-1]:
+            kept_samples = self._history[..., self._start : self._stop]
+            if self._history.shape[-1] < n + 2 * kept:
+                # Chunks grew; later chunks of this size fit without copying
+                history = np.empty(
+                    filtered.shape[:-1] + (2 * (kept + self.n_hop + n),),
+                    self.plan.dtype,
+                )
+                history[..., :kept] = kept_samples
+                self._history = history
+            else:
+                # The buffer holds at least two kept lengths, so no overlap
+                self._history[..., :kept] = kept_samples
+            self._start, self._stop = 0, kept
+        self._history[..., self._stop : self._stop + n] = filtered
+        self._stop += n
+
+    # The window is (n_bands, ..., 2 * window_epochs): each epoch is written
+    # to two slots window_epochs apart, so the latest epochs are always one
+    # slice in time order without shifting anything
+    def _allocate_window(self, shape):
+        dtype = self.plan.dtype
+        n_bands, channels = shape[-1], shape[:-1]
+        self._window = np.empty(
+            (n_bands,) + channels + (2 * self.window_epochs,), dtype
+        )
+        self._gradients = np.empty((n_bands,) + channels + (self.window_epochs,), dtype)
+        self._bai = np.empty(channels + (self.window_epochs,), dtype)
+        self._mean = np.empty(channels, dtype)
+        self._added = 0
+
+    # Add one epoch's band powers, shaped (..., n_bands), to the window
+    def add_band_powers(self, band_powers):
+        if self._window is None or self._window.shape[1:-1] != band_powers.shape[:-1]:
+            self._allocate_window(band_powers.shape)
+        slot = self._added % self.window_epochs
+        powers = np.moveaxis(band_powers, -1, 0)
+        self._window[..., slot] = powers
+        self._window[..., slot + self.window_epochs] = powers
+        self._added += 1
+        self._indices.append(self._due.popleft() if self._due else self._n_epochs)
+
+        n = min(self._added, self.window_epochs)
+        if n < 2:
+            return None  # The gradient needs at least two epochs
+
+        # (n_bands, ..., n) so each band unpacks to a (..., n) series
+        start = self._added % self.window_epochs if self._added > n else 0
+        window = self._window[..., start : start + n]
+        alpha_series, beta_series, theta_series, delta_series = window
+        if self._indices[-1] - self._indices[0] >= len(self._indices):
+            # Rejected epochs left a gap
+            bai_values = compute_bai(
+                alpha_series,
+                beta_series,
+                theta_series,
+                delta_series,
+                self.fs,
+                epoch_index=np.array(self._indices),
+            )
+        else:
+            with timed("compute_bai"):
+                bai_values = self._window_bai(window)
+        mean_bai = np.mean(bai_values, axis=-1, out=self._mean)
+        mean_bai = aggregate_channels(mean_bai, self.aggregate)
+        newest = band_powers
+        if newest.ndim > 1:
+            newest = aggregate_channels(newest, self.aggregate)
+        if newest is band_powers:
+            newest = band_powers.copy()  # band_powers may be a reused buffer
+
+        metrics = {}
+        for name in self.metrics:
+            series = METRICS[name](
+                alpha_series, beta_series, theta_series, delta_series, self.fs
+            )
+            metrics[name] = aggregate_channels(np.mean(series, axis=-1), self.aggregate)
+        return BAIUpdate(*bai_result(mean_bai, self.normalizer), newest, metrics)
+
+    # compute_bai over contiguous epochs, with the same arithmetic but in the
+    # preallocated gradient and BAI buffers
+    def _window_bai(self, window):
+        n = window.shape[-1]
+        dt = 1.0 / self.fs
+        gradients = self._gradients[..., :n]
+        np.subtract(window[..., 2:], window[..., :-2], out=gradients[..., 1:-1])
+        gradients[..., 1:-1] /= 2.0 * dt
+        np.subtract(window[..., 1], window[..., 0], out=gradients[..., 0])
+        np.subtract(window[..., -1], window[..., -2], out=gradients[..., -1])
+        gradients[..., 0] /= dt
+        gradients[..., -1] /= dt
+
+        d_alpha, d_beta, d_theta, d_delta = gradients
+        bai_values = self._bai[..., :n]
+        np.add(d_alpha, d_theta, out=bai_values)
+        bai_values *= d_delta
+        bai_values -= d_beta
+        return np.abs(bai_values, out=bai_values)
+
+
+"""
+Live pipeline: pull hop_s of fresh samples at a time and yield every BAI
+update produced by a StreamingBAI. Without channels the AF7/AF8 average is
+analyzed; with channel names each channel is analyzed separately. Samples
+are resampled from the stream's rate to the analysis rate fs on the way,
+and the analysis starts over after a break in the stream.
+"""
+
+
+def stream_eeg(
+    fs=256,
+    epoch_length_s=1.0,
+    hop_s=None,
+    window_epochs=10,
+    channels=None,
+    aggregate="mean",
+    normalizer=None,
+    artifacts=None,
+):
+    analyzer = StreamingBAI(
+        fs,
+        epoch_length_s,
+        hop_s,
+        window_epochs,
+        aggregate,
+        normalizer=normalizer,
+        artifacts=artifacts,
+    )
+    input_fs = get_stream_rate(fs)
+    resampler = StreamingResampler(input_fs, fs)
+    breaks = get_health().breaks()
+    while True:
+        if channels is None:
+            data = get_raw_eeg(duration_sec=analyzer.hop_s, fs=input_fs)
+        else:
+            data = get_eeg(duration_sec=analyzer.hop_s, fs=input_fs, channels=channels)
+        if get_health().breaks() != breaks:
+            # This chunk straddles a break in the stream
+            breaks = get_health().breaks()
+            analyzer.reset()
+            resampler.reset()
+            continue
+        yield from analyzer.update(resampler.process(data))
@@ -0,0 +1,284 @@
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from backend.bai import (
+    METRICS,
+    ArtifactDetector,
+    compute_channel_bai,
+    compute_metrics,
+    resample,
+)
+from backend.lsl import CHANNEL_MAP, FRONTAL_CHANNELS
+from backend.recorder import read_recording
+
+RECORDING_EXTENSIONS = (".csv", ".npy", ".eeg")
+OUTPUT_COLUMNS = (
+    "file",
+    "channel",
+    "epoch",
+    "t_start",
+    "alpha",
+    "beta",
+    "theta",
+    "delta",
+    "bai",
+)
+
+"""
+Load a recorded session as a (channels, samples) array, the map from
+channel name to row and the sample rate, or None when the file doesn't
+store one.
+
+.csv files have a header row naming each column; an optional "timestamp"
+column is ignored. .npy files hold a (samples, channels) array and .eeg
+files are session recordings with their rate in the header; both are laid
+out like the LSL stream, so CHANNEL_MAP applies.
+"""
+
+
+def load_recording(path):
+    if path.endswith(".eeg"):
+        records, fs = read_recording(path)
+        return records["samples"].T, CHANNEL_MAP, fs
+    if path.endswith(".npy"):
+        data = np.load(path, mmap_mode="r")
+        return np.asarray(data, dtype=float).T, CHANNEL_MAP, None
+
+    with open(path, newline="") as f:
+        header = next(csv.reader(f))
+    names = [name.strip() for name in header]
+    columns = [i for i, name in enumerate(names) if name != "timestamp"]
+    data = np.loadtxt(path, delimiter=",", skiprows=1, usecols=columns, ndmin=2)
+    channel_map = {names[column]: i for i, column in enumerate(columns)}
+    return data.T, channel_map, None
+
+
+"""
+Score one recording and return its rows for the output table.
+
+Recordings are resampled from their own rate (from the .eeg header, else
+input_fs, else fs) to the analysis rate fs, so band edges are right
+whatever device recorded them. Without per_channel the selected channels
+are averaged into one signal, as in the live pipeline; with it each
+channel is scored separately. Each
+name in metrics adds a column computed from the same band powers. With
+reject_artifacts, epochs flagged by the default ArtifactDetector are kept
+as rows with NaN values. Raises ValueError for a recording shorter than
+two epochs.
+"""
+
+
+def analyze_file(
+    path,
+    fs=256,
+    epoch_length_s=1.0,
+    channels=FRONTAL_CHANNELS,
+    per_channel=False,
+    metrics=(),
+    reject_artifacts=False,
+    input_fs=None,
+):
+    data, channel_map, recorded_fs = load_recording(path)
+    data = data[[channel_map[name] for name in channels]]
+    if per_channel:
+        labels = list(channels)
+    else:
+        data = np.mean(data, axis=0, keepdims=True)
+        labels = ["+".join(channels)]
+    # Averaged before resampling, in the same order as the live pipeline
+    data = resample(data, recorded_fs or input_fs or fs, fs)
+    # The offline detrend needs at least two epochs
+    if data.shape[-1] < 2 * int(epoch_length_s * fs):
+        raise ValueError(
+            f"too short: {data.shape[-1] / fs:.1f} s, need two {epoch_length_s} s"
+            " epochs"
+        )
+
+    bai_values, band_powers = compute_channel_bai(
+        data,
+        fs,
+        epoch_length_s,
+        mode="offline",
+        artifacts=ArtifactDetector() if reject_artifacts else None,
+    )
+    extra = list(compute_metrics(band_powers, fs, metrics).values())
+
+    rows = []
+    for channel, label in enumerate(labels):
+        for epoch in range(bai_values.shape[-1]):
+            alpha, beta, theta, delta = band_powers[channel, epoch]
+            rows.append(
+                (
+                    path,
+                    label,
+                    epoch,
+                    epoch * epoch_length_s,
+                    alpha,
+                    beta,
+                    theta,
+                    delta,
+                    bai_values[channel, epoch],
+                    *(values[channel, epoch] for values in extra),
+                )
+            )
+    return rows
+
+
+"""
+Expand directories into the recordings they contain.
+"""
+
+
+def find_recordings(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith(RECORDING_EXTENSIONS):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+
+"""
+Score every recording on a process pool and write one table row per
+channel and epoch. Rows are written in input order as files finish.
+Returns the number of files scored, of files that failed (reported on
+stderr, with no rows) and of rows written.
+"""
+
+
+def run_batch(
+    paths,
+    output,
+    fs=256,
+    epoch_length_s=1.0,
+    channels=FRONTAL_CHANNELS,
+    per_channel=False,
+    workers=None,
+    metrics=(),
+    reject_artifacts=False,
+    input_fs=None,
+):
+    files = find_recordings(paths)
+    analyze = partial(
+        _analyze_or_report,
+        fs=fs,
+        epoch_length_s=epoch_length_s,
+        channels=tuple(channels),
+        per_channel=per_channel,
+        metrics=tuple(metrics),
+        reject_artifacts=reject_artifacts,
+        input_fs=input_fs,
+    )
+
+    n_files = n_failed = n_rows = 0
+    writer = csv.writer(output)
+    writer.writerow(OUTPUT_COLUMNS + tuple(metrics))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for rows in executor.map(analyze, files):
+            if rows is None:
+                n_failed += 1
+                continue
+            writer.writerows(rows)
+            n_files += 1
+            n_rows += len(rows)
+    return n_files, n_failed, n_rows
+
+
+def _analyze_or_report(path, **kwargs):
+    try:
+        return analyze_file(path, **kwargs)
+    except Exception as e:
+        print(f"Error analyzing {path}: {e}", file=sys.stderr)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Score recorded EEG sessions with the BAI pipeline."
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="recordings or directories of recordings"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="output CSV (default: stdout)"
+    )
+    parser.add_argument(
+        "--fs", type=float, default=256, help="analysis sample rate in Hz"
+    )
+    parser.add_argument(
+        "--input-fs",
+        type=float,
+        help="sample rate of .csv and .npy inputs (default: --fs); .eeg files"
+        " carry their own",
+    )
+    parser.add_argument(
+        "--epoch-length", type=float, default=1.0, help="epoch length in seconds"
+    )
+    parser.add_argument(
+        "--channels",
+        nargs="+",
+        default=list(FRONTAL_CHANNELS),
+        help="channels to analyze",
+    )
+    parser.add_argument(
+        "--per-channel",
+        action="store_true",
+        help="score each channel separately instead of their average",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=[],
+        choices=sorted(name for name in METRICS if name != "bai"),
+        help="extra indices to add as columns",
+    )
+    parser.add_argument(
+        "--reject-artifacts",
+        action="store_true",
+        help="leave epochs with blinks, spikes or muscle noise unscored",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: all cores)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.output == "-":
+        output = sys.stdout
+    else:
+        output = open(args.output, "w", newline="")
+    try:
+        n_files, n_failed, n_rows = run_batch(
+            args.paths,
+            output,
+            fs=args.fs,
+            epoch_length_s=args.epoch_length,
+            channels=args.channels,
+            per_channel=args.per_channel,
+            workers=args.workers,
+            metrics=args.metrics,
+            reject_artifacts=args.reject_artifacts,
+            input_fs=args.input_fs,
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    failed = f", {n_failed} failed" if n_failed else ""
+    print(f"Scored {n_files} files, {n_rows} rows{failed}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
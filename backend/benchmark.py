@@ -0,0 +1,242 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import scipy
+
+from backend import lsl
+from backend.bai import (
+    SpectralEstimator,
+    StreamingBAI,
+    apply_filter,
+    compute_bai,
+    get_plan,
+    segment_epochs,
+)
+from backend.recorder import ReplayInlet
+from backend.synthetic import SyntheticInlet
+
+PERCENTILES = (50, 90, 99)
+
+"""
+Time fn over repeat calls and summarize the latencies in milliseconds.
+"""
+
+
+def time_stage(fn, repeat):
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        times[i] = time.perf_counter_ns() - start
+    times /= 1e6
+    summary = {f"p{p}_ms": float(np.percentile(times, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(np.mean(times))
+    summary["max_ms"] = float(np.max(times))
+    return summary
+
+
+"""
+Time every pipeline stage for one configuration. Acquisition drains an
+unpaced synthetic inlet (or a replayed recording) through get_eeg_window,
+the multi-channel call get_raw_eeg is built on; the DSP stages then run on
+the acquired window. "streaming_update" is the cost of one StreamingBAI
+update per epoch, i.e. the acquisition-to-score latency budget. Band
+powers use the given spectral estimator.
+"""
+
+
+def benchmark_config(
+    duration_s,
+    fs,
+    n_channels,
+    repeat,
+    epoch_length_s=1.0,
+    recording=None,
+    estimator="periodogram",
+):
+    def make_inlet():
+        if recording is not None:
+            return ReplayInlet(recording, realtime=False)
+        return SyntheticInlet(fs, n_channels, realtime=False, seed=0)
+
+    lsl.set_inlet(make_inlet())
+
+    def acquire():
+        # Start from a fresh source when a recording runs out
+        if recording is not None and lsl.get_inlet().exhausted():
+            lsl.set_inlet(make_inlet())
+        return lsl.get_eeg_window(duration_s, fs)
+
+    plan = get_plan(fs, epoch_length_s, estimator=estimator)
+    spectral = SpectralEstimator(plan)
+    data = np.array(acquire()[0])
+    filtered = apply_filter(data, fs)
+    epochs = segment_epochs(filtered, fs, epoch_length_s)
+    band_powers = spectral.band_powers(epochs).copy()
+    alpha, beta, theta, delta = np.moveaxis(band_powers, -1, 0)
+
+    n_epoch = int(epoch_length_s * fs)
+    analyzer = StreamingBAI(fs, epoch_length_s, plan=plan)
+    analyzer.update(data[..., : 2 * n_epoch])
+    epoch_data = data[..., :n_epoch]
+
+    stages = {
+        "get_eeg_window": acquire,
+        "apply_filter": lambda: apply_filter(data, fs),
+        "segment_epochs": lambda: segment_epochs(filtered, fs, epoch_length_s),
+        "band_powers": lambda: spectral.band_powers(epochs),
+        "compute_bai": lambda: compute_bai(alpha, beta, theta, delta, fs),
+        "streaming_update": lambda: analyzer.update(epoch_data),
+    }
+
+    results = []
+    for stage, fn in stages.items():
+        result = {
+            "stage": stage,
+            "estimator": estimator,
+            "duration_s": duration_s,
+            "fs": fs,
+            "n_channels": data.shape[0],
+            "n_samples": data.shape[-1],
+        }
+        result.update(time_stage(fn, repeat))
+        results.append(result)
+    return results
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+"""
+Stages whose median latency grew by more than tolerance (a fraction)
+relative to a baseline report with the same configurations.
+"""
+
+
+def find_regressions(results, baseline, tolerance=0.2):
+    def key(result):
+        return (
+            result["stage"],
+            result.get("estimator", "periodogram"),
+            result["duration_s"],
+            result["fs"],
+            result["n_channels"],
+        )
+
+    reference = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = reference.get(key(result))
+        if before is not None and result["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            regressions.append((result, before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the BAI pipeline."
+    )
+    parser.add_argument(
+        "--durations",
+        type=float,
+        nargs="+",
+        default=[10.0],
+        help="window lengths in seconds",
+    )
+    parser.add_argument(
+        "--rates", type=float, nargs="+", default=[256], help="sample rates in Hz"
+    )
+    parser.add_argument(
+        "--channels", type=int, nargs="+", default=[4], help="channel counts"
+    )
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per stage")
+    parser.add_argument(
+        "--estimator",
+        choices=("periodogram", "welch", "multitaper"),
+        default="periodogram",
+        help="spectral estimator for the band powers",
+    )
+    parser.add_argument(
+        "--recording", help="replay this session file instead of synthetic data"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="output JSON (default: stdout)"
+    )
+    parser.add_argument(
+        "--baseline", help="previous output to check for regressions against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed median slowdown before a stage counts as regressed",
+    )
+    args = parser.parse_args(argv)
+
+    if args.recording is not None:
+        # The recording fixes the rate and channel count
+        configs = [(duration, None, None) for duration in args.durations]
+    else:
+        configs = [
+            (duration, fs, n_channels)
+            for duration in args.durations
+            for fs in args.rates
+            for n_channels in args.channels
+        ]
+
+    results = []
+    for duration, fs, n_channels in configs:
+        if args.recording is not None:
+            fs = ReplayInlet(args.recording).fs
+        config_results = benchmark_config(
+            duration,
+            fs,
+            n_channels,
+            args.repeat,
+            recording=args.recording,
+            estimator=args.estimator,
+        )
+        results += config_results
+        for result in config_results:
+            print(
+                f"{result['stage']:>16} {result['duration_s']:>6g}s "
+                f"{result['fs']:>6g}Hz {result['n_channels']:>3}ch "
+                f"p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms",
+                file=sys.stderr,
+            )
+
+    report = {"environment": environment(), "results": results}
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for result, before in regressions:
+            print(
+                f"Regression: {result['stage']} {result['fs']:g}Hz "
+                f"{result['n_channels']}ch {before['p50_ms']:.3f} -> "
+                f"{result['p50_ms']:.3f} ms",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from functools import wraps
+
+PERCENTILES = (50, 90, 99)
+
+_enabled = os.environ.get("FOCUSTUTOR_INSTRUMENT", "1") != "0"
+_lock = threading.Lock()
+_histograms = {}
+_counters = Counter()
+_profiler = None
+
+"""
+Latency histogram with log-spaced buckets from 1 us, four per doubling,
+so recording is O(1) and memory is fixed however many samples are seen.
+Percentiles are read from the buckets and are accurate to about 10%.
+"""
+
+
+class Histogram:
+    MIN_S = 1e-6
+    BUCKETS_PER_DOUBLING = 4
+    N_BUCKETS = 112  # Up to about 4 minutes
+
+    def __init__(self):
+        self.counts = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds > self.MIN_S:
+            index = int(math.log2(seconds / self.MIN_S) * self.BUCKETS_PER_DOUBLING)
+            index = min(index, self.N_BUCKETS - 1)
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        target = p / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                # Geometric middle of the bucket
+                return self.MIN_S * 2 ** ((index + 0.5) / self.BUCKETS_PER_DOUBLING)
+        return self.max
+
+    def summary(self):
+        summary = {"count": self.count}
+        if self.count:
+            summary["mean_ms"] = self.total / self.count * 1000
+            for p in PERCENTILES:
+                summary[f"p{p}_ms"] = min(self.percentile(p), self.max) * 1000
+            summary["max_ms"] = self.max * 1000
+        return summary
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def record(stage, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.add(seconds)
+
+
+def count(name, n=1):
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+"""
+Time a block of code as one sample of stage:
+
+    with timed("fft"):
+        ...
+"""
+
+
+class timed:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self.start)
+
+
+"""
+Decorator that records every call of the function as one sample of stage.
+When instrumentation is disabled the only cost is one flag check.
+"""
+
+
+def instrumented(stage):
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+def snapshot():
+    with _lock:
+        stages = {stage: h.summary() for stage, h in sorted(_histograms.items())}
+        counters = dict(_counters)
+    return {"time": time.time(), "stages": stages, "counters": counters}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+"""
+Append a snapshot as one JSON line to path ("-" for stderr) every
+interval_s seconds until the returned event is set.
+"""
+
+
+def start_export(path, interval_s=10.0):
+    stop = threading.Event()
+
+    def export():
+        while not stop.wait(interval_s):
+            line = json.dumps(snapshot()) + "\n"
+            if path == "-":
+                sys.stderr.write(line)
+            else:
+                with open(path, "a") as f:
+                    f.write(line)
+
+    threading.Thread(target=export, daemon=True).start()
+    return stop
+
+
+"""
+Statistical profiler: a background thread samples every other thread's
+Python stack every interval_s and counts each stack, root first. Costs
+nothing until started.
+"""
+
+
+class SamplingProfiler:
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = tuple(
+                    f"{os.path.basename(entry.filename)}:{entry.name}"
+                    for entry in traceback.extract_stack(frame)
+                )
+                self.stacks[stack] += 1
+            self.samples += 1
+
+    # Self time per function, most sampled first, as (function, fraction)
+    def top(self, n=20):
+        functions = Counter()
+        for stack, hits in self.stacks.items():
+            functions[stack[-1]] += hits
+        total = sum(functions.values()) or 1
+        return [(name, hits / total) for name, hits in functions.most_common(n)]
+
+    # Collapsed stacks, one "root;...;leaf count" line each, for flame graphs
+    def write_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack, hits in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {hits}\n")
+
+
+def start_profiler(interval_s=0.005):
+    global _profiler
+    stop_profiler()
+    _profiler = SamplingProfiler(interval_s)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler():
+    global _profiler
+    profiler = _profiler
+    if profiler is not None:
+        profiler.stop()
+        _profiler = None
+    return profiler
+
+
+"""
+Start exporting and profiling as asked by the environment:
+FOCUSTUTOR_STATS=<path> writes a snapshot every FOCUSTUTOR_STATS_INTERVAL
+seconds (default 10), and FOCUSTUTOR_PROFILE=<path> samples stacks until
+finish_from_env() writes them there as collapsed stacks.
+"""
+
+
+def configure_from_env():
+    path = os.environ.get("FOCUSTUTOR_STATS")
+    if path:
+        start_export(path, float(os.environ.get("FOCUSTUTOR_STATS_INTERVAL", 10)))
+    if os.environ.get("FOCUSTUTOR_PROFILE"):
+        start_profiler()
+
+
+def finish_from_env():
+    profiler = stop_profiler()
+    path = os.environ.get("FOCUSTUTOR_PROFILE")
+    if profiler is not None and path:
+        profiler.write_collapsed(path)
@@ -1,53 +1,381 @@
-from pylsl import StreamInlet, resolve_streams
+from pylsl import StreamInlet, proc_clocksync, proc_dejitter, resolve_streams
 import numpy as np
+import time
+
+from backend.instrument import instrumented
+from backend.recorder import SessionRecorder
 
 _inlet = None # Global inlet cache
+_buffer = None # Global ring buffer cache
+_recorder = None # Active session recorder, if any
+_health = None # Health of the current stream
+_resolved = False # Whether _inlet was resolved here (and can be re-resolved)
+_fs = None # Nominal rate of _inlet's stream, None if it doesn't report one
+
+BUFFER_SECONDS = 60 # How much history the ring buffer keeps
+DEFAULT_FS = 256 # Assumed rate for streams that don't report one
+CHUNK_SAMPLES = 1024 # Upper bound on samples per pull_chunk call
+
+STREAM_NAME = 'PetalStream_eeg' # Stream the single-headset app connects to
+MAX_FILL_SECONDS = 0.25 # Longer gaps are flagged instead of interpolated
+STALE_SECONDS = 5.0 # Re-resolve the stream after this long without samples
+CLOCK_SYNC_SECONDS = 5.0 # How often the clock offset is re-measured
+
+# Channel name -> index in the stream's samples (Muse/Petal layout)
+CHANNEL_MAP = {'TP9': 0, 'AF7': 1, 'AF8': 2, 'TP10': 3}
+FRONTAL_CHANNELS = ('AF7', 'AF8')
+
+'''
+resolve the streams whose name is in names or whose source id is in
+source_ids. with neither, every stream of type EEG is returned
+'''
+def find_streams(names=None, source_ids=None, wait_time=1):
+    streams = resolve_streams(wait_time=wait_time)
+    if names is None and source_ids is None:
+        return [stream for stream in streams if stream.type() == 'EEG']
+    return [stream for stream in streams
+            if stream.name() in (names or ()) or stream.source_id() in (source_ids or ())]
+
+'''
+open an inlet whose timestamps are mapped onto the local clock
+(proc_clocksync) and smoothed to the source's actual rate (proc_dejitter),
+so receive jitter isn't mistaken for missing samples
+'''
+def open_inlet(stream):
+    return StreamInlet(stream, processing_flags=proc_clocksync | proc_dejitter)
 
 '''
-get the inlet from the stream
+get the inlet from the stream, or None if the stream can't be found
 '''
 def get_inlet():
-    global _inlet
+    global _inlet, _resolved, _fs
     if _inlet is None:
         print("Resolving streams")
-        streams = resolve_streams(wait_time=1)
-        eeg_stream = None
-
-        for stream in streams:
-            if stream.name() == 'PetalStream_eeg':
-                eeg_stream = stream
-                break
+        streams = find_streams(names=(STREAM_NAME,))
 
-        if eeg_stream is None:
+        if not streams:
             print("No EEG stream found")
-            exit(1)
+            return None
+        eeg_stream = streams[0]
 
         print("Inlet created")
-        _inlet = StreamInlet(eeg_stream)
+        _inlet = open_inlet(eeg_stream)
+        _fs = eeg_stream.nominal_srate() or None
+        _resolved = True
 
     return _inlet
 
 '''
-get average of af7 and af8 channels
+use another source (e.g. a ReplayInlet) in place of the lsl stream. the
+rate is read once from inlet.info(), as for a StreamInlet
+'''
+def set_inlet(inlet):
+    global _inlet, _buffer, _health, _resolved, _fs
+    _inlet = inlet
+    _fs = None if inlet is None else inlet.info().nominal_srate() or None
+    _buffer = None
+    _health = None
+    _resolved = False
+
+'''
+drop a resolved inlet that stopped delivering so the next call resolves
+the stream again. the ring buffer is kept, so analysis carries on across
+the reconnect
+'''
+def _reconnect():
+    global _inlet
+    print("EEG stream stalled, reconnecting")
+    get_health().reconnects += 1
+    _inlet = None
+
+'''
+the nominal sample rate of the current stream, or default if there is no
+stream or it doesn't report a rate. the rate is cached when the inlet is
+opened, so this is cheap enough to call on every pull
+'''
+def get_stream_rate(default=DEFAULT_FS):
+    if get_inlet() is None:
+        return default
+    return _fs or default
+
+'''
+health metrics of the current stream
+'''
+def get_health(fs=DEFAULT_FS):
+    global _health
+    if _health is None:
+        _health = StreamHealth(fs)
+    return _health
+
+'''
+record every acquired sample and its timestamp to a session file
+'''
+def start_recording(path, fs=None):
+    global _recorder
+    stop_recording()
+    inlet = get_inlet()
+    if inlet is None:
+        print("Not recording: no EEG stream")
+        return None
+    fs = get_stream_rate() if fs is None else fs
+    _recorder = SessionRecorder(path, inlet.channel_count, fs)
+    return _recorder
+
+'''
+stop recording and close the session file
+'''
+def stop_recording():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+'''
+preallocated ring buffer holding every channel plus the lsl timestamps.
+the storage is written twice (at i and i + capacity) so that the latest
+n <= capacity samples are always one contiguous slice, which lets
+latest() hand out views instead of copies. views are only valid until
+the next write overwrites them.
+'''
+class EEGRingBuffer:
+    def __init__(self, n_channels, capacity, dtype=np.float64):
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.count = 0 # Total samples ever written
+        self._data = np.zeros((n_channels, 2 * capacity), dtype=dtype)
+        self._timestamps = np.zeros(2 * capacity)
+
+    def write(self, samples, timestamps):
+        samples = np.asarray(samples, dtype=self._data.dtype).reshape(-1, self.n_channels)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(timestamps)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        for offset in (0, self.capacity):
+            self._data[:, offset + start:offset + start + first] = samples[:first].T
+            self._data[:, offset:offset + n - first] = samples[first:].T
+            self._timestamps[offset + start:offset + start + first] = timestamps[:first]
+            self._timestamps[offset:offset + n - first] = timestamps[first:]
+        self.count += n
+
+    def latest(self, n_samples):
+        n_samples = min(n_samples, self.count, self.capacity)
+        end = self.count % self.capacity + self.capacity
+        return self._data[:, end - n_samples:end], self._timestamps[end - n_samples:end]
+
+'''
+timing health of one stream. every chunk's timestamps are checked against
+the nominal rate: jitter is a running average of how far sample intervals
+stray from 1/fs, gaps of up to MAX_FILL_SECONDS are filled by linear
+interpolation, and longer ones are counted as dropouts and left unfilled.
+the lsl clock offset of the source is re-measured every CLOCK_SYNC_SECONDS
+'''
+class StreamHealth:
+    def __init__(self, fs=256, max_fill_s=MAX_FILL_SECONDS):
+        self.fs = fs
+        self.max_fill_s = max_fill_s
+        self.samples = 0
+        self.filled_samples = 0
+        self.gaps = 0 # Short gaps that were filled
+        self.dropouts = 0 # Long gaps that were flagged
+        self.dropout_seconds = 0.0
+        self.jitter_ms = 0.0
+        self.clock_offset = None
+        self.reconnects = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.last_sample = None
+        self.last_arrival = time.monotonic()
+        self._last_sync = None
+
+    # Returns the samples and timestamps to store, with short gaps filled
+    def check(self, samples, timestamps):
+        samples = np.asarray(samples, dtype=np.float64)
+        samples = samples.reshape(len(timestamps), -1)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.last_arrival = time.monotonic()
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamps[0]
+
+        if self.last_timestamp is not None:
+            samples = np.concatenate(([self.last_sample], samples))
+            timestamps = np.concatenate(([self.last_timestamp], timestamps))
+        intervals = np.diff(timestamps)
+        # Anything over 1.5 sample periods may mean samples went missing
+        missing = intervals > 1.5 / self.fs
+        if len(intervals) > np.count_nonzero(missing):
+            error = np.abs(intervals[~missing] - 1.0 / self.fs)
+            self.jitter_ms += 0.1 * (np.mean(error) * 1000 - self.jitter_ms)
+
+        gaps = np.flatnonzero(missing)
+        if len(gaps):
+            samples, timestamps = self._fill(samples, timestamps, gaps)
+        if self.last_timestamp is not None:
+            samples, timestamps = samples[1:], timestamps[1:]
+
+        self.samples += len(timestamps)
+        self.last_timestamp = timestamps[-1]
+        self.last_sample = samples[-1]
+        return samples, timestamps
+
+    def _fill(self, samples, timestamps, gaps):
+        # How many samples each one runs behind its place at the nominal
+        # rate. A real gap moves every later sample back; a late sample
+        # followed by an early one moves nothing, so it isn't filled
+        lag = (timestamps - timestamps[0]) * self.fs - np.arange(len(timestamps))
+        sample_pieces, timestamp_pieces = [], []
+        start = 0
+        for i in gaps:
+            sample_pieces.append(samples[start:i + 1])
+            timestamp_pieces.append(timestamps[start:i + 1])
+            start = i + 1
+            gap_s = timestamps[i + 1] - timestamps[i]
+            missing = int(round(np.min(lag[i + 1:]) - np.max(lag[:i + 1])))
+            if missing <= 0:
+                continue
+            if gap_s > self.max_fill_s:
+                self.dropouts += 1
+                self.dropout_seconds += gap_s
+                continue
+            fraction = np.arange(1, missing + 1)[:, None] / (missing + 1)
+            sample_pieces.append(samples[i] + fraction * (samples[i + 1] - samples[i]))
+            timestamp_pieces.append(timestamps[i] + fraction[:, 0] * gap_s)
+            self.gaps += 1
+            self.filled_samples += missing
+        sample_pieces.append(samples[start:])
+        timestamp_pieces.append(timestamps[start:])
+        return np.concatenate(sample_pieces), np.concatenate(timestamp_pieces)
+
+    def sync_clock(self, inlet):
+        now = time.monotonic()
+        if self._last_sync is not None and now - self._last_sync < CLOCK_SYNC_SECONDS:
+            return
+        self._last_sync = now
+        if not hasattr(inlet, 'time_correction'):
+            return # Replayed and synthetic sources share the local clock
+        try:
+            self.clock_offset = inlet.time_correction(timeout=0.5)
+        except Exception as e:
+            print(f"Error measuring clock offset: {e}")
+
+    # Number of breaks in the data (long dropouts and reconnects) so far;
+    # samples on either side of a break aren't contiguous
+    def breaks(self):
+        return self.dropouts + self.reconnects
+
+    def stale(self, seconds=STALE_SECONDS):
+        return time.monotonic() - self.last_arrival > seconds
+
+    def snapshot(self):
+        span = 0.0
+        if self.first_timestamp is not None:
+            span = self.last_timestamp - self.first_timestamp
+        return {
+            'samples': self.samples,
+            'effective_rate': float(self.samples / span) if span > 0 else None,
+            'jitter_ms': float(self.jitter_ms),
+            'gaps_filled': self.gaps,
+            'samples_filled': self.filled_samples,
+            'dropouts': self.dropouts,
+            'dropout_seconds': float(self.dropout_seconds),
+            'clock_offset': self.clock_offset,
+            'reconnects': self.reconnects,
+            'seconds_since_data': time.monotonic() - self.last_arrival,
+        }
+
+'''
+drain whatever the inlet has buffered into the ring buffer with one
+pull_chunk call, returning the number of samples stored. with a health
+tracker, gaps are checked and short ones filled on the way in
+'''
+def pull_into(inlet, buffer, timeout=0.0, max_samples=CHUNK_SAMPLES, health=None):
+    chunk, timestamps = inlet.pull_chunk(timeout=timeout, max_samples=max_samples)
+    n = len(timestamps)
+    if n:
+        if health is not None:
+            health.sync_clock(inlet)
+            chunk, timestamps = health.check(chunk, timestamps)
+            n = len(timestamps)
+        buffer.write(chunk, timestamps)
+    return n
+
+'''
+get the ring buffer attached to the inlet
 '''
-def get_raw_eeg(duration_sec=10, fs=256):
+def get_buffer(fs=DEFAULT_FS):
+    global _buffer
     inlet = get_inlet()
-    n_samples = int(duration_sec * fs)
-    data = []
-    
-    for _ in range(n_samples):
+    if _buffer is None or (inlet is not None and inlet.channel_count != _buffer.n_channels):
+        if inlet is None:
+            return None
+        _buffer = EEGRingBuffer(inlet.channel_count, int(BUFFER_SECONDS * fs))
+    return _buffer
+
+'''
+get the latest duration_sec of fresh samples for all channels as
+(channels x samples) and (samples,) views into the ring buffer, at the
+stream's own rate unless fs is given. may return fewer samples (or none)
+if the stream is missing or stalls; a resolved stream that stays silent
+for STALE_SECONDS is resolved again
+'''
+def get_eeg_window(duration_sec=10, fs=None):
+    inlet = get_inlet()
+    if inlet is None:
+        time.sleep(min(duration_sec, 1.0)) # Don't spin while the stream is away
+        if _buffer is None:
+            return np.zeros((len(CHANNEL_MAP), 0)), np.zeros(0)
+        return _buffer.latest(0)
+    fs = get_stream_rate() if fs is None else fs
+
+    buffer = get_buffer(fs)
+    health = get_health(fs)
+    health.fs = fs # The health may have been created before the rate was known
+    n_samples = min(int(duration_sec * fs), buffer.capacity)
+    deadline = time.monotonic() + duration_sec + 1.0
+    received = 0
+
+    while received < n_samples and time.monotonic() < deadline:
         try:
-            sample, timestamp = inlet.pull_sample(timeout=0.1)
-            if sample is not None:
-                af7 = sample[1]
-                af8 = sample[2]
-                average = (af7 + af8) / 2
-                data.append(average)
+            n = pull_into(inlet, buffer, timeout=0.1,
+                          max_samples=min(CHUNK_SAMPLES, n_samples - received),
+                          health=health)
+            recorder = _recorder # May be stopped from another thread
+            if n and recorder is not None:
+                data, timestamps = buffer.latest(n)
+                recorder.write(data.T, timestamps)
+            received += n
         except Exception as e:
-            print(f"Error pulling sample: {e}")
-    
-    if not data:
-        print("Warning: No LSL data received, returning random data")
-        pass
-        
-    return np.array(data)
+            print(f"Error pulling chunk: {e}")
+            time.sleep(0.1)
+
+    if _resolved and health.stale():
+        _reconnect()
+    return buffer.latest(min(received, buffer.capacity))
+
+'''
+get the named channels as a (channels x samples) array, looking each name
+up in channel_map
+'''
+def get_eeg(duration_sec=10, fs=None, channels=FRONTAL_CHANNELS, channel_map=CHANNEL_MAP):
+    data, timestamps = get_eeg_window(duration_sec, fs)
+    indices = [channel_map[name] for name in channels]
+    return data[indices]
+
+'''
+get average of af7 and af8 channels
+'''
+@instrumented('get_raw_eeg')
+def get_raw_eeg(duration_sec=10, fs=None, channels=FRONTAL_CHANNELS, channel_map=CHANNEL_MAP):
+    data = get_eeg(duration_sec, fs, channels, channel_map)
+
+    if data.shape[-1] == 0:
+        print("Warning: No LSL data received")
+        return np.zeros(0)
+
+    return np.mean(data, axis=0)
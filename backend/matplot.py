@@ -1,3 +1,4 @@
+import time
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
@@ -6,36 +7,192 @@ matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 
+from backend.instrument import instrumented
+from backend.lsl import EEGRingBuffer
+
+BAND_NAMES = ("Alpha", "Beta", "Theta", "Delta")
+
+'''
+whole-session history in at most max_bins (min, max) bins. when the bins
+run out, neighbouring pairs are merged and each bin covers twice as many
+points, so memory stays bounded however long the session.
+'''
+class MinMaxHistory:
+    def __init__(self, max_bins=512):
+        self.max_bins = max_bins - max_bins % 2
+        self.points_per_bin = 1
+        self.n_bins = 0
+        self.t = np.zeros(self.max_bins)
+        self.min = np.zeros(self.max_bins)
+        self.max = np.zeros(self.max_bins)
+        self._in_bin = 0 # Points in the last, still filling bin
+
+    def add(self, t, value):
+        if self._in_bin == 0:
+            if self.n_bins == self.max_bins:
+                self._merge()
+            self.t[self.n_bins] = t
+            self.min[self.n_bins] = value
+            self.max[self.n_bins] = value
+            self.n_bins += 1
+        else:
+            i = self.n_bins - 1
+            self.min[i] = min(self.min[i], value)
+            self.max[i] = max(self.max[i], value)
+        self._in_bin = (self._in_bin + 1) % self.points_per_bin
+
+    def _merge(self):
+        half = self.n_bins // 2
+        self.t[:half] = self.t[0:self.n_bins:2]
+        self.min[:half] = np.minimum(self.min[0:self.n_bins:2], self.min[1:self.n_bins:2])
+        self.max[:half] = np.maximum(self.max[0:self.n_bins:2], self.max[1:self.n_bins:2])
+        self.n_bins = half
+        self.points_per_bin *= 2
+
+    # The envelope as one polyline visiting each bin's min then max
+    def envelope(self):
+        n = self.n_bins
+        return np.repeat(self.t[:n], 2), np.column_stack((self.min[:n], self.max[:n])).ravel()
+
+'''
+the top two axes show the last capacity points of the BAI and the band
+powers at full resolution; they are kept in a fixed-size ring buffer and
+only the lines are redrawn (blitted) on top of a cached background. the
+axes are only rescaled, with a full redraw, when a point leaves the
+current limits, and redraws happen at most once every min_redraw_ms. the
+bottom axes show a min/max-decimated overview of the whole session,
+refreshed every overview_ms.
+'''
 class RealTimeBAIView(tk.Frame):
-    def __init__(self, parent, update_ms=1000):
+    def __init__(self, parent, update_ms=1000, capacity=600, min_redraw_ms=200,
+                 overview_ms=5000, overview_bins=512):
         super().__init__(parent)
         self.update_ms = update_ms
-        self.t = []
-        self.bai = []
+        self.min_redraw_ms = min_redraw_ms
+        self.overview_ms = overview_ms
+        # Rows: BAI, then the alpha/beta/theta/delta powers
+        self.points = EEGRingBuffer(1 + len(BAND_NAMES), capacity)
+        self.history = MinMaxHistory(overview_bins)
         self.t_elapsed = 0.0
+        self._background = None
+        self._last_redraw = 0.0
+        self._last_overview = 0.0
+        self._redraw_id = None
+        self._needs_full_draw = False
         self._build_figures()
 
     def _build_figures(self):
-        fig = Figure(figsize=(5, 2.5), dpi=100)
-        self.ax_bai = fig.add_subplot(1, 1, 1)
+        fig = Figure(figsize=(5, 5), dpi=100)
+        self.ax_bai = fig.add_subplot(3, 1, 1)
         self.ax_bai.set_title("Brain Activity Index")
-        self.ax_bai.set_xlabel("Time (s)")
         self.ax_bai.set_ylabel("BAI")
-        (self.line_bai,) = self.ax_bai.plot([], [], alpha=0.8)
+        (self.line_bai,) = self.ax_bai.plot([], [], alpha=0.8, animated=True)
+
+        self.ax_bands = fig.add_subplot(3, 1, 2, sharex=self.ax_bai)
+        self.ax_bands.set_ylabel("Band power")
+        self.ax_bands.set_xlabel("Time (s)")
+        self.ax_bands.set_yscale("log")
+        self.ax_bands.set_ylim(1.0, 10.0)
+        self.band_lines = [
+            self.ax_bands.plot([], [], alpha=0.8, label=name, animated=True)[0]
+            for name in BAND_NAMES
+        ]
+        self.ax_bands.legend(loc="upper left", fontsize="small", ncol=len(BAND_NAMES))
+
+        self.ax_overview = fig.add_subplot(3, 1, 3)
+        self.ax_overview.set_title("Session overview")
+        self.ax_overview.set_xlabel("Time (s)")
+        self.ax_overview.set_ylabel("BAI")
+        (self.line_overview,) = self.ax_overview.plot([], [], linewidth=0.8)
+        fig.tight_layout()
 
         self.canvas = FigureCanvasTkAgg(fig, master=self)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(fill="both", expand=True)
 
-    def update_bai(self, bai_value):
+    def update_bai(self, bai_value, band_powers=None):
         self.t_elapsed += self.update_ms / 1000.0
-        self.t.append(self.t_elapsed)
-        self.bai.append(bai_value)
+        if band_powers is None:
+            band_powers = [np.nan] * len(BAND_NAMES)
+        values = np.concatenate(([bai_value], band_powers))
+        self.points.write([values], [self.t_elapsed])
+        self.history.add(self.t_elapsed, bai_value)
+        self._needs_full_draw |= self._extend_limits(self.t_elapsed, values)
+        self._schedule_redraw()
 
-        self.line_bai.set_data(self.t, self.bai)
-        self.ax_bai.relim()
-        self.ax_bai.autoscale_view()
-        self.canvas.draw()
+    def _extend_limits(self, t, values):
+        changed = False
+        x_min, x_max = self.ax_bai.get_xlim()
+        if t > x_max:
+            # Jump ahead by a quarter window so the x axis changes rarely
+            window = self.points.capacity * self.update_ms / 1000.0
+            self.ax_bai.set_xlim(max(0.0, t - 0.75 * window), t + 0.25 * window)
+            changed = True
+
+        changed |= _extend_ylim(self.ax_bai, values[:1])
+        # Only positive powers can go on the log axis
+        powers = values[1:]
+        changed |= _extend_ylim(self.ax_bands, powers[powers > 0], log=True)
+        return changed
+
+    def _schedule_redraw(self):
+        if self._redraw_id is not None:
+            return
+        wait_ms = self.min_redraw_ms - (time.monotonic() - self._last_redraw) * 1000
+        self._redraw_id = self.after(max(0, int(wait_ms)), self._redraw)
+
+    @instrumented('plot_redraw')
+    def _redraw(self):
+        self._redraw_id = None
+        self._last_redraw = time.monotonic()
+        values, t = self.points.latest(self.points.capacity)
+        self.line_bai.set_data(t, values[0])
+        for line, powers in zip(self.band_lines, values[1:]):
+            line.set_data(t, powers)
+
+        if (self._last_redraw - self._last_overview) * 1000 >= self.overview_ms:
+            self._last_overview = self._last_redraw
+            self.line_overview.set_data(*self.history.envelope())
+            self.ax_overview.relim()
+            self.ax_overview.autoscale_view()
+            self._needs_full_draw = True
+
+        if self._needs_full_draw or self._background is None:
+            self._needs_full_draw = False
+            self.canvas.draw()  # Re-caches the background through _on_draw
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_animated()
+        self.canvas.blit(self.canvas.figure.bbox)
+
+    def _draw_animated(self):
+        self.ax_bai.draw_artist(self.line_bai)
+        for line in self.band_lines:
+            self.ax_bands.draw_artist(line)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_animated()
+
+'''
+widen ax's y limits, with a margin, if any of values falls outside them
+'''
+def _extend_ylim(ax, values, log=False):
+    if len(values) == 0:
+        return False
+    y_min, y_max = ax.get_ylim()
+    low, high = np.min(values), np.max(values)
+    if y_min <= low and high <= y_max:
+        return False
+    low, high = min(y_min, low), max(y_max, high)
+    if log:
+        ax.set_ylim(low / 2, high * 2)
+    else:
+        margin = 0.1 * (high - low or abs(high) or 1.0)
+        ax.set_ylim(low - margin, high + margin)
+    return True
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -44,8 +201,8 @@ if __name__ == "__main__":
 
     def dummy_update():
         bai_val = np.random.rand()
-        view.update_bai(bai_val)
+        view.update_bai(bai_val, np.random.rand(len(BAND_NAMES)) * 100)
         view.after(view.update_ms, dummy_update)
 
     view.after(view.update_ms, dummy_update)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_DB = os.path.join(os.path.expanduser("~"), ".focustutor", "metrics.db")
+DAY_S = 24 * 60 * 60
+
+"""
+Sessions are BCI runs, blocks are the timer phases (Study, Short Break,
+Long Break, Reset) seen during a session, and metrics hold one row per
+BAI update, with any extra indices as a JSON object in "extra". Each
+block also keeps a running count and sum of its values, so per-block and
+per-phase means are read from the blocks table alone through its
+(phase, started) index, however many metrics were recorded.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    phase TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL,
+    n_values INTEGER NOT NULL DEFAULT 0,
+    value_sum REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    session_id INTEGER NOT NULL,
+    block_id INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    t REAL NOT NULL,
+    value REAL NOT NULL,
+    state TEXT NOT NULL,
+    alpha REAL,
+    beta REAL,
+    theta REAL,
+    delta REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_phase ON blocks (phase, started);
+CREATE INDEX IF NOT EXISTS blocks_session ON blocks (session_id);
+CREATE INDEX IF NOT EXISTS metrics_session_phase ON metrics (session_id, phase, t);
+CREATE INDEX IF NOT EXISTS metrics_block ON metrics (block_id);
+"""
+
+"""
+Local SQLite store of session metrics.
+
+Values added with add() are buffered and written in one transaction once
+batch_size rows are pending or flush_s seconds have passed since the last
+write. Timestamps are wall-clock seconds (time.time()). Not thread-safe:
+use a store from the thread that created it.
+"""
+
+
+class MetricsStore:
+    def __init__(self, path=DEFAULT_DB, batch_size=64, flush_s=5.0):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.session_id = None
+        self.block_id = None
+        self.phase = None
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(metrics)")]
+        if "extra" not in columns:
+            # Databases created before extra metrics were stored
+            self._conn.execute("ALTER TABLE metrics ADD COLUMN extra TEXT")
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def start_session(self, t=None):
+        if self.session_id is not None:
+            self.end_session(t)
+        t = time.time() if t is None else t
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO sessions (started) VALUES (?)", (t,)
+            )
+        self.session_id = cursor.lastrowid
+        if self.phase is not None:
+            self._open_block(self.phase, t)
+        return self.session_id
+
+    def end_session(self, t=None):
+        if self.session_id is None:
+            return
+        t = time.time() if t is None else t
+        self.flush()
+        with self._conn:
+            self._close_block(t)
+            self._conn.execute(
+                "UPDATE sessions SET ended = ? WHERE id = ?", (t, self.session_id)
+            )
+        self.session_id = None
+
+    # Start a new block when the timer phase changes
+    def set_phase(self, phase, t=None):
+        if phase == self.phase:
+            return
+        self.phase = phase
+        if self.session_id is None:
+            return
+        t = time.time() if t is None else t
+        self.flush()
+        with self._conn:
+            self._close_block(t)
+        self._open_block(phase, t)
+
+    def add(self, value, state, band_powers=None, t=None, metrics=None):
+        if self.block_id is None:
+            return
+        t = time.time() if t is None else t
+        alpha, beta, theta, delta = (
+            (None,) * 4 if band_powers is None else [float(p) for p in band_powers]
+        )
+        self._pending.append(
+            (
+                self.session_id,
+                self.block_id,
+                self.phase,
+                t,
+                float(value),
+                state,
+                alpha,
+                beta,
+                theta,
+                delta,
+                (
+                    None
+                    if not metrics
+                    else json.dumps(
+                        {name: float(value) for name, value in metrics.items()}
+                    )
+                ),
+            )
+        )
+        if (
+            len(self._pending) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_s
+        ):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        totals = {}
+        for row in self._pending:
+            n, total = totals.get(row[1], (0, 0.0))
+            totals[row[1]] = (n + 1, total + row[4])
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._conn.executemany(
+                "UPDATE blocks SET n_values = n_values + ?, value_sum = value_sum + ?"
+                " WHERE id = ?",
+                [(n, total, block_id) for block_id, (n, total) in totals.items()],
+            )
+        self._pending = []
+
+    def close(self):
+        self.end_session()
+        self._conn.close()
+
+    def _open_block(self, phase, t):
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO blocks (session_id, phase, started) VALUES (?, ?, ?)",
+                (self.session_id, phase, t),
+            )
+        self.block_id = cursor.lastrowid
+
+    def _close_block(self, t):
+        if self.block_id is not None:
+            self._conn.execute(
+                "UPDATE blocks SET ended = ? WHERE id = ?", (t, self.block_id)
+            )
+            self.block_id = None
+
+    # Mean value of every block of phase started in the last days days, oldest
+    # first, as (block id, session id, started, ended, n, mean) rows
+    def focus_per_block(self, phase="Study", days=90, now=None):
+        now = time.time() if now is None else now
+        self.flush()
+        return self._conn.execute(
+            "SELECT id, session_id, started, ended, n_values,"
+            " value_sum / n_values FROM blocks"
+            " WHERE phase = ? AND started >= ? AND n_values > 0 ORDER BY started",
+            (phase, now - days * DAY_S),
+        ).fetchall()
+
+    # Mean value over all blocks of phase in the last days days
+    def mean_focus(self, phase="Study", days=90, now=None):
+        now = time.time() if now is None else now
+        self.flush()
+        (mean,) = self._conn.execute(
+            "SELECT SUM(value_sum) / SUM(n_values) FROM blocks"
+            " WHERE phase = ? AND started >= ? AND n_values > 0",
+            (phase, now - days * DAY_S),
+        ).fetchone()
+        return mean
+
+    # Every metric row of one session, optionally of one phase, in time order
+    def session_metrics(self, session_id, phase=None):
+        self.flush()
+        if phase is None:
+            return self._conn.execute(
+                "SELECT * FROM metrics WHERE session_id = ? ORDER BY t", (session_id,)
+            ).fetchall()
+        return self._conn.execute(
+            "SELECT * FROM metrics WHERE session_id = ? AND phase = ? ORDER BY t",
+            (session_id, phase),
+        ).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize recorded focus per timer block."
+    )
+    parser.add_argument("--db", default=DEFAULT_DB, help="metrics database")
+    parser.add_argument("--phase", default="Study", help="timer phase to summarize")
+    parser.add_argument("--days", type=float, default=90, help="look-back in days")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No metrics database at {args.db}")
+        return
+
+    store = MetricsStore(args.db)
+    for block_id, session_id, started, ended, n, mean in store.focus_per_block(
+        args.phase, args.days
+    ):
+        start = time.strftime("%Y-%m-%d %H:%M", time.localtime(started))
+        minutes = "running" if ended is None else f"{(ended - started) / 60:5.1f} min"
+        print(f"{start}  session {session_id:>4}  {minutes:>9}  {n:>5}  {mean:7.2f}")
+    mean = store.mean_focus(args.phase, args.days)
+    if mean is not None:
+        print(f"Mean {args.phase.lower()} focus over {args.days:g} days: {mean:.2f}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
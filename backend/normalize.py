@@ -0,0 +1,94 @@
+import json
+import math
+import os
+
+DEFAULT_PROFILE = os.path.join(
+    os.path.expanduser("~"), ".focustutor", "calibration.json"
+)
+
+"""
+Online per-user normalization of BAI values onto 0-1.
+
+BAI spans many orders of magnitude and depends on device gain, so values
+are tracked as log10(BAI). During calibration (the first
+calibration_updates values) the mean and variance are plain running
+statistics (Welford); afterwards they follow an exponentially weighted
+mean and variance with the given half-life in updates, so the scale keeps
+adapting to slow drift. A value is normalized as the normal CDF of its
+z-score against those statistics, so 0.5 is the user's typical BAI.
+Memory is O(1) and the statistics can be saved and restored per user.
+"""
+
+
+class ScoreNormalizer:
+    def __init__(
+        self,
+        calibration_updates=60,
+        halflife=300,
+        path=None,
+        mean=0.0,
+        var=0.0,
+        count=0,
+    ):
+        self.calibration_updates = calibration_updates
+        self.halflife = halflife
+        self.path = path
+        self.mean = mean
+        self.var = var
+        self.count = count
+        self._alpha = 1 - 0.5 ** (1 / halflife)
+
+    @property
+    def calibrated(self):
+        return self.count >= self.calibration_updates
+
+    def normalize(self, value, update=True):
+        x = math.log10(max(float(value), 1e-12))
+        if self.count < 2 or self.var <= 0:
+            normalized = 0.5
+        else:
+            z = (x - self.mean) / math.sqrt(self.var)
+            normalized = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+        if update:
+            self.update(value)
+        return normalized
+
+    def update(self, value):
+        x = math.log10(max(float(value), 1e-12))
+        was_calibrated = self.calibrated
+        self.count += 1
+        diff = x - self.mean
+        if not was_calibrated:
+            self.mean += diff / self.count
+            self.var += (diff * (x - self.mean) - self.var) / self.count
+            if self.calibrated and self.path is not None:
+                self.save()
+        else:
+            self.mean += self._alpha * diff
+            self.var = (1 - self._alpha) * (self.var + self._alpha * diff * diff)
+
+    def to_dict(self):
+        return {
+            "calibration_updates": self.calibration_updates,
+            "halflife": self.halflife,
+            "mean": self.mean,
+            "var": self.var,
+            "count": self.count,
+        }
+
+    def save(self, path=None):
+        path = self.path if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    # Restore saved statistics, or start a new calibration if there are none
+    @classmethod
+    def load(cls, path=DEFAULT_PROFILE, **kwargs):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return cls(path=path, **kwargs)
+        state.update(kwargs)
+        return cls(path=path, **state)
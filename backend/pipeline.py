@@ -0,0 +1,205 @@
+import threading
+from collections import deque
+
+from backend import instrument
+from backend.bai import StreamingBAI, StreamingResampler
+from backend.lsl import get_health, get_raw_eeg, get_stream_rate
+
+"""
+Bounded FIFO between two pipeline stages.
+
+When the queue is full, put follows policy: "drop_oldest" evicts the
+oldest item to make room, "drop_newest" discards the new item, and
+"block" waits up to timeout for room before discarding it. Every discard
+is counted in dropped.
+"""
+
+
+class BoundedQueue:
+    def __init__(self, maxsize, policy="drop_oldest"):
+        if policy not in ("drop_oldest", "drop_newest", "block"):
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item, timeout=None):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == "drop_newest" or not self._cond.wait_for(
+                    lambda: len(self._items) < self.maxsize, timeout
+                ):
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def drain(self):
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+            self._cond.notify_all()
+            return items
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "put": self.put_count,
+            "dropped": self.dropped,
+        }
+
+
+"""
+Acquisition, DSP and UI delivery as separate stages.
+
+An acquisition thread keeps draining chunk_s of samples at a time into
+the raw queue, a DSP thread feeds them to a StreamingBAI and puts each
+(value, focus state) on the results queue, and the UI drains the results
+queue from its own thread with poll(). Queues drop rather than block
+(by default), so acquisition never waits behind the FFT or the plot.
+After a break in the stream (a long dropout or a reconnect) the analyzer
+starts over rather than filtering across the break.
+Chunks arrive at input_fs (by default the LSL stream's nominal rate) and
+the DSP thread resamples them to the analyzer's rate first.
+"""
+
+
+class BCIPipeline:
+    def __init__(
+        self,
+        acquire=None,
+        analyzer=None,
+        chunk_s=0.25,
+        raw_queue_size=16,
+        result_queue_size=16,
+        raw_policy="drop_oldest",
+        result_policy="drop_oldest",
+        input_fs=None,
+    ):
+        self.acquire = get_raw_eeg if acquire is None else acquire
+        self.analyzer = StreamingBAI() if analyzer is None else analyzer
+        self.chunk_s = chunk_s
+        self.input_fs = input_fs
+        self.resampler = None
+        self.raw = BoundedQueue(raw_queue_size, raw_policy)
+        self.results = BoundedQueue(result_queue_size, result_policy)
+
+        self.acquired_chunks = 0
+        self.acquired_samples = 0
+        self.acquisition_errors = 0
+        self.processed_chunks = 0
+        self.dsp_errors = 0
+        self.restarts = 0
+
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self.running() and not self._stop.is_set():
+            return
+        # Let threads from a previous stop() finish before starting new ones
+        for thread in self._threads:
+            thread.join()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._acquire_loop, daemon=True),
+            threading.Thread(target=self._dsp_loop, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def poll(self):
+        return self.results.drain()
+
+    def stats(self):
+        return {
+            "acquisition": {
+                "chunks": self.acquired_chunks,
+                "samples": self.acquired_samples,
+                "errors": self.acquisition_errors,
+            },
+            "raw_queue": self.raw.stats(),
+            "dsp": {
+                "chunks": self.processed_chunks,
+                "errors": self.dsp_errors,
+                "restarts": self.restarts,
+            },
+            "result_queue": self.results.stats(),
+            "stream": get_health().snapshot(),
+            "timings": instrument.snapshot()["stages"],
+        }
+
+    def _acquire_loop(self):
+        while not self._stop.is_set():
+            try:
+                # get_raw_eeg returns a fresh array, not a view into the ring buffer
+                chunk = self.acquire(duration_sec=self.chunk_s)
+            except Exception as e:
+                print(f"Error acquiring EEG: {e}")
+                self.acquisition_errors += 1
+                self._stop.wait(self.chunk_s)
+                continue
+            if chunk.shape[-1] == 0:
+                continue
+            self.acquired_chunks += 1
+            self.acquired_samples += chunk.shape[-1]
+            # Tagged with the stream's break count, so the DSP thread can tell
+            # that this chunk straddles a break
+            self.raw.put((chunk, get_health().breaks()), timeout=0)
+
+    def _dsp_loop(self):
+        breaks = 0
+        while not self._stop.is_set():
+            item = self.raw.get(timeout=0.1)
+            if item is None:
+                continue
+            chunk, chunk_breaks = item
+            if chunk_breaks != breaks:
+                # Drop the chunk spanning the break and start the analysis over
+                breaks = chunk_breaks
+                self.analyzer.reset()
+                if self.resampler is not None:
+                    self.resampler.reset()
+                self.restarts += 1
+                continue
+            try:
+                if self.resampler is None:
+                    input_fs = self.input_fs or get_stream_rate(self.analyzer.fs)
+                    self.resampler = StreamingResampler(input_fs, self.analyzer.fs)
+                chunk = self.resampler.process(chunk)
+                for result in self.analyzer.update(chunk):
+                    self.results.put(result, timeout=0)
+            except Exception as e:
+                print(f"Error analyzing EEG: {e}")
+                self.dsp_errors += 1
+            self.processed_chunks += 1
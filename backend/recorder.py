@@ -0,0 +1,146 @@
+import os
+import struct
+import time
+
+import numpy as np
+from pylsl import StreamInfo
+
+"""
+Session files are a 64-byte header followed by fixed-size records of one
+float64 LSL timestamp and n_channels float64 samples, so a whole file can
+be memory-mapped as a structured array without parsing.
+"""
+
+SESSIONS_DIR = os.path.join(os.path.expanduser("~"), ".focustutor", "sessions")
+MAGIC = b"FTEEG\x00"
+VERSION = 1
+HEADER = struct.Struct("<6sHId")
+HEADER_SIZE = 64
+
+
+def record_dtype(n_channels):
+    return np.dtype([("timestamp", "<f8"), ("samples", "<f8", (n_channels,))])
+
+
+"""
+Read a session file as a read-only memory map. Returns the records, with
+"timestamp" and "samples" fields, and the nominal sample rate.
+"""
+
+
+def read_recording(path):
+    with open(path, "rb") as f:
+        magic, version, n_channels, fs = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a focus tutor session file")
+
+    dtype = record_dtype(n_channels)
+    n_records = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=dtype), fs
+    records = np.memmap(
+        path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(n_records,)
+    )
+    return records, fs
+
+
+"""
+Default location of a new session file: SESSIONS_DIR named by start time.
+"""
+
+
+def session_path(t=None):
+    t = time.time() if t is None else t
+    name = time.strftime("%Y%m%d-%H%M%S", time.localtime(t)) + ".eeg"
+    return os.path.join(SESSIONS_DIR, name)
+
+
+"""
+Append raw multi-channel samples and their LSL timestamps to a session
+file as they are acquired.
+"""
+
+
+class SessionRecorder:
+    def __init__(self, path, n_channels, fs):
+        self.path = path
+        self.n_channels = n_channels
+        self.dtype = record_dtype(n_channels)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(
+            HEADER.pack(MAGIC, VERSION, n_channels, fs).ljust(HEADER_SIZE, b"\0")
+        )
+
+    def write(self, samples, timestamps):
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, self.n_channels)
+        records = np.empty(len(samples), dtype=self.dtype)
+        records["timestamp"] = timestamps
+        records["samples"] = samples
+        self._file.write(records.tobytes())
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+"""
+Stand-in for a pylsl StreamInlet that plays a session file back.
+
+With realtime=True samples are released on the schedule given by their
+recorded timestamps (scaled by speed); otherwise every pull returns as
+much as requested, as fast as the consumer can take it. Once the file is
+exhausted pulls return nothing after waiting out their timeout.
+"""
+
+
+class ReplayInlet:
+    def __init__(self, path, realtime=True, speed=1.0):
+        self.records, self.fs = read_recording(path)
+        self.channel_count = self.records.dtype["samples"].shape[0]
+        self.realtime = realtime
+        self.speed = speed
+        self._offsets = self.records["timestamp"] - (
+            self.records["timestamp"][0] if len(self.records) else 0.0
+        )
+        self._pos = 0
+        self._start = None
+
+    # The stream's description, as StreamInlet.info() returns it
+    def info(self):
+        return StreamInfo("Replay_eeg", "EEG", self.channel_count, self.fs, "double64")
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024):
+        end = min(self._pos + max_samples, len(self.records))
+        if self.realtime and end > self._pos:
+            if self._start is None:
+                self._start = time.monotonic()
+            elapsed = (time.monotonic() - self._start) * self.speed
+            due = np.searchsorted(
+                self._offsets, elapsed + timeout * self.speed, side="right"
+            )
+            end = max(self._pos, min(end, due))
+            if end > self._pos:
+                wait = (self._offsets[end - 1] - elapsed) / self.speed
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                time.sleep(timeout)
+        elif end == self._pos:
+            time.sleep(timeout)
+
+        chunk = self.records[self._pos : end]
+        self._pos = end
+        return chunk["samples"], chunk["timestamp"]
+
+    def exhausted(self):
+        return self._pos >= len(self.records)
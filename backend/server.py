@@ -0,0 +1,333 @@
+import argparse
+import contextlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from backend import lsl
+from backend.bai import (
+    ArtifactDetector,
+    SpectralEstimator,
+    StreamingBAI,
+    StreamingResampler,
+    get_plan,
+)
+from backend.normalize import ScoreNormalizer
+from backend.service import LineServer, add_analysis_arguments, update_message
+
+"""
+One headset: its inlet, ring buffer and StreamingBAI. Without channels the
+AF7/AF8 average is analyzed, as in the single-headset app; with channel
+names each channel is analyzed separately and combined with aggregate.
+Samples arrive at the stream's rate fs and are resampled to analysis_fs,
+so headsets with different rates still share one analysis plan. Like the
+single-headset app, a subject whose stream goes silent for
+lsl.STALE_SECONDS is resolved again by stream_name or source_id, and its
+analysis starts over after every break in the stream. Epochs flagged by
+artifacts' sample tests never reach the batched FFT, and EMG is checked
+in its spectra. dtype=np.float32 runs the spectral stage and window in
+single precision (see StreamingBAI).
+"""
+
+
+class Subject:
+    def __init__(
+        self,
+        name,
+        inlet,
+        fs,
+        analysis_fs=256,
+        epoch_length_s=1.0,
+        hop_s=None,
+        window_epochs=10,
+        channels=None,
+        aggregate="mean",
+        estimator="periodogram",
+        normalizer=None,
+        metrics=(),
+        artifacts=None,
+        dtype=np.float64,
+        stream_name=None,
+        source_id=None,
+    ):
+        self.name = name
+        self.inlet = inlet
+        self.stream_name = stream_name
+        self.source_id = source_id
+        self.fs = fs
+        self.buffer = lsl.EEGRingBuffer(
+            inlet.channel_count, int(lsl.BUFFER_SECONDS * fs)
+        )
+        self.average = channels is None
+        channels = lsl.FRONTAL_CHANNELS if channels is None else channels
+        self.indices = [lsl.CHANNEL_MAP[channel] for channel in channels]
+        self.resampler = StreamingResampler(fs, analysis_fs)
+        plan = get_plan(analysis_fs, epoch_length_s, estimator=estimator, dtype=dtype)
+        self.analyzer = StreamingBAI(
+            analysis_fs,
+            epoch_length_s,
+            hop_s,
+            window_epochs,
+            aggregate,
+            plan=plan,
+            normalizer=normalizer,
+            metrics=metrics,
+            artifacts=artifacts,
+        )
+        self.health = lsl.StreamHealth(fs)
+        self.errors = 0
+
+    # Drain the inlet and return the epochs that became due
+    def pull(self):
+        if self.health.stale():
+            self.reconnect()
+        breaks = self.health.breaks()
+        received = 0
+        while self.inlet is not None:
+            n = lsl.pull_into(self.inlet, self.buffer, health=self.health)
+            received += n
+            if n < lsl.CHUNK_SAMPLES:
+                break
+        if self.health.breaks() != breaks:
+            # These samples straddle a break, so start the analysis over
+            self.analyzer.reset()
+            self.resampler.reset()
+            return []
+        if received == 0:
+            return []
+        data, _ = self.buffer.latest(received)
+        data = data[self.indices]
+        if self.average:
+            data = np.mean(data, axis=0)
+        return self.analyzer.epochs(self.resampler.process(data))
+
+    # Resolve the stream again; until it is back, retry every STALE_SECONDS
+    def reconnect(self):
+        self.health.last_arrival = time.monotonic()
+        if self.stream_name is None and self.source_id is None:
+            return
+        print(f"Stream of {self.name} stalled, reconnecting")
+        self.health.reconnects += 1
+        self.inlet = None
+        for stream in lsl.find_streams((self.stream_name,), (self.source_id,), 0.5):
+            if stream.source_id() == self.source_id or not self.source_id:
+                self.inlet = lsl.open_inlet(stream)
+                break
+
+
+"""
+Resolve streams by name or source id and open one Subject per stream.
+Subjects are named by source id, or by stream name when a stream has no
+source id.
+"""
+
+
+def connect_subjects(names=None, source_ids=None, wait_time=2, **kwargs):
+    subjects = {}
+    for stream in lsl.find_streams(names, source_ids, wait_time):
+        name = stream.source_id() or stream.name()
+        if name in subjects:
+            name = f"{name}_{len(subjects)}"
+        rate = stream.nominal_srate() or lsl.DEFAULT_FS
+        subjects[name] = Subject(
+            name,
+            lsl.open_inlet(stream),
+            rate,
+            stream_name=stream.name(),
+            source_id=stream.source_id() or None,
+            **kwargs,
+        )
+    return subjects
+
+
+"""
+Analyze many headsets in one process.
+
+Every interval_s the inlets are drained and their samples filtered and
+epoched in a worker pool. Due epochs with the same analysis plan and shape
+are stacked across subjects so each group's band powers come from one
+batched FFT, also run in the pool, and each subject's BAIUpdate is then
+passed to publish(subject name, update). The stacks and spectral buffers
+are kept per group and reused from one step to the next. An error is
+printed and counted in the failing subjects' errors, or in errors if it
+happened outside any one subject, and the other subjects carry on.
+"""
+
+
+class MultiSubjectServer:
+    def __init__(self, subjects, publish, interval_s=0.25, workers=None):
+        self.subjects = subjects
+        self.publish = publish
+        self.interval_s = interval_s
+        self.workers = workers
+        self.updates = 0
+        self.errors = 0
+        self._stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        with ThreadPoolExecutor(self.workers) as pool:
+            while not self._stop.wait(self.interval_s):
+                try:
+                    self.step(pool)
+                except Exception as e:
+                    print(f"Error in server step: {e}")
+                    self.errors += 1
+
+    def step(self, pool):
+        subjects = list(self.subjects.values())
+        groups = defaultdict(list)
+        for subject, epochs in zip(subjects, pool.map(self._pull, subjects)):
+            for epoch in epochs:
+                groups[(subject.analyzer.plan, epoch.shape)].append((subject, epoch))
+
+        keys = list(groups)
+        batches = pool.map(lambda key: self._band_powers(key, groups[key]), keys)
+        for key, batch in zip(keys, batches):
+            if batch is None:
+                continue
+            # A subject's epochs stay in order within its group
+            for (subject, _), powers, power in zip(groups[key], *batch):
+                try:
+                    if subject.analyzer.reject_spectrum(power):
+                        continue
+                    update = subject.analyzer.add_band_powers(powers)
+                    if update is not None:
+                        self.updates += 1
+                        self.publish(subject.name, update)
+                except Exception as e:
+                    print(f"Error analyzing {subject.name}: {e}")
+                    subject.errors += 1
+
+    def _pull(self, subject):
+        try:
+            return subject.pull()
+        except Exception as e:
+            print(f"Error pulling {subject.name}: {e}")
+            subject.errors += 1
+            return []
+
+    # The band powers and power spectra of the group's epochs, both in the
+    # estimator's buffers (add_band_powers copies), or None if the batch failed
+    def _band_powers(self, key, items):
+        plan, shape = key
+        try:
+            # One buffer and estimator per group size, so neither is
+            # reallocated when the number of subjects due changes
+            stack_key = (key, len(items))
+            if stack_key not in self._stacks:
+                self._stacks[stack_key] = (
+                    np.empty((len(items),) + shape, plan.dtype),
+                    SpectralEstimator(plan),
+                )
+            buffer, estimator = self._stacks[stack_key]
+            stacked = np.stack([epoch for _, epoch in items], out=buffer)
+            return estimator.band_powers(stacked), estimator.power
+        except Exception as e:
+            subjects = {subject.name: subject for subject, _ in items}
+            print(f"Error computing band powers for {', '.join(subjects)}: {e}")
+            for subject in subjects.values():
+                subject.errors += 1
+            return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze many EEG streams at once and publish per-subject JSON lines."
+    )
+    parser.add_argument("--names", nargs="+", help="stream names to connect to")
+    parser.add_argument("--source-ids", nargs="+", help="stream source ids")
+    add_analysis_arguments(parser)
+    parser.add_argument(
+        "--estimator",
+        choices=("periodogram", "welch", "multitaper"),
+        default="periodogram",
+        help="spectral estimator for the band powers",
+    )
+    parser.add_argument(
+        "--profiles",
+        help="directory of per-subject calibration files (default: raw scores)",
+    )
+    parser.add_argument("-j", "--workers", type=int, help="worker threads")
+    parser.add_argument(
+        "--port", type=int, help="serve JSON lines on this localhost TCP port"
+    )
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        subjects = connect_subjects(
+            args.names,
+            args.source_ids,
+            analysis_fs=args.fs,
+            epoch_length_s=args.epoch_length,
+            hop_s=args.hop,
+            window_epochs=args.window,
+            channels=args.channels,
+            estimator=args.estimator,
+            metrics=args.metrics,
+            artifacts=ArtifactDetector() if args.reject_artifacts else None,
+            dtype=np.float32 if args.float32 else np.float64,
+        )
+    if not subjects:
+        print("No EEG streams found", file=sys.stderr)
+        sys.exit(1)
+    if args.profiles is not None:
+        for name, subject in subjects.items():
+            subject.analyzer.normalizer = ScoreNormalizer.load(
+                os.path.join(args.profiles, f"{name}.json")
+            )
+    print(
+        f"Analyzing {len(subjects)} stream(s): {', '.join(subjects)}", file=sys.stderr
+    )
+
+    out = sys.stdout if args.port is None else LineServer(port=args.port)
+    lock = threading.Lock()
+
+    def publish(name, update):
+        message = dict(subject=name, **update_message(update))
+        with lock:
+            out.write(json.dumps(message) + "\n")
+            out.flush()
+
+    server = MultiSubjectServer(subjects, publish, workers=args.workers)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            server.start()
+            while server.running() and not stop.wait(1.0):
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for subject in subjects.values():
+            if subject.analyzer.normalizer is not None:
+                subject.analyzer.normalizer.save()
+        if args.port is not None:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
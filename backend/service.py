@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import json
+import signal
+import socket
+import sys
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+from backend import instrument, lsl
+from backend.bai import METRICS, ArtifactDetector, StreamingBAI
+from backend.normalize import DEFAULT_PROFILE, ScoreNormalizer
+from backend.pipeline import BCIPipeline
+from backend.recorder import ReplayInlet
+
+BAND_KEYS = ("alpha", "beta", "theta", "delta")
+
+"""
+Serve newline-terminated messages to every client connected to a local
+TCP port. Clients that disconnect, or that cannot take a message within
+send_timeout seconds, are dropped, so a stalled reader holds up the others
+for at most send_timeout once.
+"""
+
+
+class LineServer:
+    def __init__(self, host="127.0.0.1", port=8765, send_timeout=0.1):
+        self._server = socket.create_server((host, port))
+        self.send_timeout = send_timeout
+        self._clients = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return  # Server closed
+            client.settimeout(self.send_timeout)
+            with self._lock:
+                self._clients.append(client)
+
+    def write(self, line):
+        data = line.encode()
+        with self._lock:
+            for client in list(self._clients):
+                try:
+                    client.sendall(data)
+                except OSError:  # Including a timeout
+                    client.close()
+                    self._clients.remove(client)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+
+
+"""
+One BAIUpdate as a JSON-serializable dict. Per-channel updates keep their
+lists of values and states.
+"""
+
+
+def update_message(update, t=None):
+    value = update.value
+    if isinstance(value, (list, tuple)):
+        value = [float(v) for v in value]
+    else:
+        value = float(value)
+    message = {
+        "t": time.time() if t is None else t,
+        "value": value,
+        "state": update.state,
+    }
+    if update.band_powers is not None:
+        band_powers = np.moveaxis(np.asarray(update.band_powers), -1, 0)
+        message["band_powers"] = dict(zip(BAND_KEYS, band_powers.tolist()))
+    if update.metrics:
+        message["metrics"] = {
+            name: np.asarray(value).tolist() for name, value in update.metrics.items()
+        }
+    return message
+
+
+"""
+Add the analysis options shared by the service and the multi-subject
+server to parser.
+"""
+
+
+def add_analysis_arguments(parser):
+    parser.add_argument(
+        "--fs", type=float, default=256, help="analysis sample rate in Hz"
+    )
+    parser.add_argument(
+        "--epoch-length", type=float, default=1.0, help="epoch length in seconds"
+    )
+    parser.add_argument(
+        "--hop", type=float, default=None, help="seconds between updates"
+    )
+    parser.add_argument(
+        "--window", type=int, default=10, help="epochs in the rolling window"
+    )
+    parser.add_argument(
+        "--channels",
+        nargs="+",
+        choices=sorted(lsl.CHANNEL_MAP),
+        help="analyze these channels separately instead of the AF7/AF8 average",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=[],
+        choices=sorted(name for name in METRICS if name != "bai"),
+        help="extra indices to report alongside the BAI",
+    )
+    parser.add_argument(
+        "--reject-artifacts",
+        action="store_true",
+        help="skip epochs with blinks, spikes or muscle noise",
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="analyze in single precision to halve buffer memory",
+    )
+
+
+"""
+Run acquisition and BAI analysis without a GUI, writing one JSON line per
+update to out until stop is set.
+"""
+
+
+def run_service(pipeline, out, stop, poll_s=0.1):
+    pipeline.start()
+    try:
+        while not stop.wait(poll_s):
+            for update in pipeline.poll():
+                out.write(json.dumps(update_message(update)) + "\n")
+            out.flush()
+    finally:
+        pipeline.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the BAI pipeline headless and emit JSON lines."
+    )
+    add_analysis_arguments(parser)
+    parser.add_argument(
+        "--aggregate",
+        choices=("mean", "median", "none"),
+        default="mean",
+        help="how per-channel results are combined",
+    )
+    parser.add_argument(
+        "--profile",
+        default=DEFAULT_PROFILE,
+        help="per-user calibration file (default: the GUI's)",
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="score with the fixed divisor instead of the user calibration",
+    )
+    parser.add_argument(
+        "--port", type=int, help="serve JSON lines on this localhost TCP port"
+    )
+    parser.add_argument("--replay", help="analyze this session file in real time")
+    parser.add_argument(
+        "--record", metavar="PATH", help="also record the raw EEG to this session file"
+    )
+    args = parser.parse_args(argv)
+
+    if args.replay is not None:
+        lsl.set_inlet(ReplayInlet(args.replay))
+
+    normalizer = None if args.raw else ScoreNormalizer.load(args.profile)
+    analyzer = StreamingBAI(
+        args.fs,
+        args.epoch_length,
+        args.hop,
+        args.window,
+        None if args.aggregate == "none" else args.aggregate,
+        normalizer=normalizer,
+        metrics=args.metrics,
+        artifacts=ArtifactDetector() if args.reject_artifacts else None,
+        dtype=np.float32 if args.float32 else np.float64,
+    )
+    if args.channels is None:
+        acquire = lsl.get_raw_eeg
+    else:
+        acquire = partial(lsl.get_eeg, channels=args.channels)
+    pipeline = BCIPipeline(acquire, analyzer, chunk_s=analyzer.hop_s)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    out = sys.stdout if args.port is None else LineServer(port=args.port)
+    instrument.configure_from_env()
+    try:
+        # Status messages go to stderr so stdout carries only JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.record is not None:
+                lsl.start_recording(args.record)
+            run_service(pipeline, out, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lsl.stop_recording()
+        instrument.finish_from_env()
+        if normalizer is not None:
+            normalizer.save()
+        if args.port is not None:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet, local_clock
+
+from backend.bai import ALPHA_BAND, BETA_BAND, DELTA_BAND, THETA_BAND
+
+BAND_RANGES = {
+    "alpha": ALPHA_BAND,
+    "beta": BETA_BAND,
+    "theta": THETA_BAND,
+    "delta": DELTA_BAND,
+}
+DEFAULT_AMPLITUDES = {"alpha": 10.0, "beta": 5.0, "theta": 5.0, "delta": 20.0}
+
+"""
+Synthetic multi-channel EEG with controllable band content.
+
+Each channel is a sum of one sinusoid per band, at a frequency drawn
+inside the band and a random phase, with the given amplitude, plus white
+noise. Samples are generated in (samples, channels) chunks and stay
+continuous from one chunk to the next.
+"""
+
+
+class SyntheticEEG:
+    def __init__(self, fs=256, n_channels=5, amplitudes=None, noise=2.0, seed=None):
+        self.fs = fs
+        self.n_channels = n_channels
+        self.noise = noise
+        self._rng = np.random.default_rng(seed)
+        self._n = 0
+
+        amplitudes = DEFAULT_AMPLITUDES if amplitudes is None else amplitudes
+        freqs = []
+        self._amplitudes = []
+        for name, amplitude in amplitudes.items():
+            low, high = BAND_RANGES[name]
+            freqs.append(self._rng.uniform(low, high, n_channels))
+            self._amplitudes.append(amplitude)
+        # (n_bands, n_channels)
+        self._omega = 2 * np.pi * np.array(freqs).reshape(-1, n_channels) / fs
+        self._phase = self._rng.uniform(0, 2 * np.pi, self._omega.shape)
+        self._amplitudes = np.array(self._amplitudes).reshape(-1, 1)
+
+    def generate(self, n_samples):
+        n = np.arange(self._n, self._n + n_samples).reshape(-1, 1, 1)
+        self._n += n_samples
+        waves = self._amplitudes * np.sin(self._omega * n + self._phase)
+        signal = waves.sum(axis=1)
+        if self.noise:
+            signal += self._rng.normal(0.0, self.noise, signal.shape)
+        return signal
+
+
+"""
+In-process stand-in for a pylsl StreamInlet backed by SyntheticEEG.
+
+With realtime=True a pull returns the samples that would have arrived
+since the previous pull at fs; otherwise every pull returns max_samples
+immediately. Timestamps come from the LSL clock at the nominal rate.
+"""
+
+
+class SyntheticInlet:
+    def __init__(self, fs=256, n_channels=5, realtime=True, **kwargs):
+        self.fs = fs
+        self.channel_count = n_channels
+        self.realtime = realtime
+        self.source = SyntheticEEG(fs, n_channels, **kwargs)
+        self._t0 = None
+        self._sent = 0
+
+    # The stream's description, as StreamInlet.info() returns it
+    def info(self):
+        return StreamInfo(
+            "Synthetic_eeg", "EEG", self.channel_count, self.fs, "float32"
+        )
+
+    def pull_chunk(self, timeout=0.0, max_samples=1024):
+        if self._t0 is None:
+            self._t0 = local_clock()
+        if self.realtime:
+            due = int((local_clock() - self._t0) * self.fs) - self._sent
+            if due <= 0 and timeout > 0:
+                time.sleep(min(timeout, (1 - due) / self.fs))
+                due = int((local_clock() - self._t0) * self.fs) - self._sent
+            n = max(0, min(due, max_samples))
+        else:
+            n = max_samples
+
+        timestamps = self._t0 + (self._sent + np.arange(n)) / self.fs
+        self._sent += n
+        return self.source.generate(n), timestamps
+
+
+"""
+Publish a SyntheticEEG over LSL until stop is set. Samples are pushed in
+chunks of chunk_s seconds, paced against the LSL clock so the stream
+keeps its nominal rate.
+"""
+
+
+def run_outlet(
+    name="PetalStream_eeg",
+    fs=256,
+    n_channels=5,
+    chunk_s=0.05,
+    source_id=None,
+    stop=None,
+    **kwargs,
+):
+    info = StreamInfo(
+        name, "EEG", n_channels, fs, "float32", source_id or f"synthetic-{name}"
+    )
+    outlet = StreamOutlet(info)
+    source = SyntheticEEG(fs, n_channels, **kwargs)
+    stop = threading.Event() if stop is None else stop
+
+    chunk_samples = max(1, int(chunk_s * fs))
+    t0 = local_clock()
+    sent = 0
+    while not stop.is_set():
+        due = int((local_clock() - t0) * fs) - sent
+        if due < chunk_samples:
+            time.sleep((chunk_samples - due) / fs)
+            continue
+        outlet.push_chunk(source.generate(due).astype(np.float32))
+        sent += due
+
+
+"""
+Start n_streams synthetic outlets on daemon threads. With more than one
+stream the names get a numeric suffix. Returns the event that stops them.
+"""
+
+
+def start_outlets(name="PetalStream_eeg", n_streams=1, **kwargs):
+    stop = threading.Event()
+    for i in range(n_streams):
+        stream_name = name if n_streams == 1 else f"{name}_{i}"
+        threading.Thread(
+            target=run_outlet,
+            kwargs=dict(kwargs, name=stream_name, stop=stop),
+            daemon=True,
+        ).start()
+    return stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Publish synthetic EEG streams over LSL."
+    )
+    parser.add_argument("--name", default="PetalStream_eeg", help="stream name")
+    parser.add_argument("--fs", type=float, default=256, help="sample rate in Hz")
+    parser.add_argument("--channels", type=int, default=5, help="channels per stream")
+    parser.add_argument(
+        "--streams", type=int, default=1, help="number of concurrent streams"
+    )
+    parser.add_argument(
+        "--noise", type=float, default=2.0, help="white noise standard deviation"
+    )
+    for band, amplitude in DEFAULT_AMPLITUDES.items():
+        parser.add_argument(
+            f"--{band}",
+            type=float,
+            default=amplitude,
+            help=f"{band} amplitude (default: {amplitude})",
+        )
+    args = parser.parse_args(argv)
+
+    amplitudes = {band: getattr(args, band) for band in DEFAULT_AMPLITUDES}
+    stop = start_outlets(
+        args.name,
+        args.streams,
+        fs=args.fs,
+        n_channels=args.channels,
+        amplitudes=amplitudes,
+        noise=args.noise,
+    )
+    print(f"Publishing {args.streams} synthetic stream(s), Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
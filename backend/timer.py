@@ -1,20 +1,98 @@
-def remaining(timer_status, long_break_interval, timer_remain_total_secs, long_interval_count):
-    if timer_remain_total_secs > 0:
-        timer_remain_total_secs -= 1
-        
-    if timer_remain_total_secs <= 0:
-        if timer_status == "Study":
-            long_interval_count += 1
-            if long_interval_count % long_break_interval == 0:
-                timer_status = "Long Break"
+from collections import namedtuple
+import math
+import time
+
+from pylsl import local_clock
+
+'''
+one phase change of a PomodoroTimer. t is when the phase started on the
+timer's clock (pylsl.local_clock by default, the clock lsl timestamps are
+mapped onto, so t lines up with eeg sample timestamps), wall is the same
+moment as time.time(), and deadline is when the phase ends (None for Reset)
+'''
+PhaseChange = namedtuple("PhaseChange", ["phase", "previous", "t", "wall", "deadline"])
+
+'''
+deadline-driven pomodoro timer. a running phase is an absolute deadline on a
+monotonic clock, so remaining time is computed rather than counted down and
+never drifts however late the caller wakes up. when a deadline has passed,
+advance() starts the next phase at that deadline (not at the late wakeup)
+and returns a PhaseChange for every transition it made.
+settings is any object with study_time, short_break_time and long_break_time
+in minutes and long_break_interval; durations are read when a phase starts
+'''
+class PomodoroTimer:
+    def __init__(self, settings, clock=local_clock):
+        self.settings = settings
+        self.clock = clock
+        self.phase = "Reset"
+        self.deadline = None
+        self.long_interval_count = 0
+        self.events = [] # Every phase change so far, oldest first
+
+    def duration(self, phase):
+        minutes = {
+            "Study": self.settings.study_time,
+            "Short Break": self.settings.short_break_time,
+            "Long Break": self.settings.long_break_time,
+        }[phase]
+        return minutes * 60
+
+    # Start phase now (or at now on the timer's clock)
+    def start(self, phase, now=None):
+        now = self.clock() if now is None else now
+        return self._change(phase, now, now + self.duration(phase))
+
+    def reset(self, now=None):
+        now = self.clock() if now is None else now
+        self.long_interval_count = 0
+        return self._change("Reset", now, None)
+
+    # Run every transition whose deadline has passed, in order
+    def advance(self, now=None):
+        now = self.clock() if now is None else now
+        events = []
+        while self.deadline is not None and self.deadline <= now:
+            if self.phase == "Study":
+                self.long_interval_count += 1
+                interval = self.settings.long_break_interval
+                if interval and self.long_interval_count % interval == 0:
+                    phase = "Long Break"
+                else:
+                    phase = "Short Break"
             else:
-                timer_status = "Short Break"
-        elif timer_status == "Short Break" or timer_status == "Long Break":
-            timer_status = "Study"
-        else:
-            if timer_status == "Reset":
-                print("Error: Timer status is reset, but the timer is still running.")
-            else:
-                print("Error: Timer status is not recognized.")
-    
-    return timer_status, timer_remain_total_secs, long_interval_count
\ No newline at end of file
+                phase = "Study"
+            start = self.deadline
+            events.append(self._change(phase, start, start + self.duration(phase), now))
+        return events
+
+    # Seconds left in the current phase (0 when reset)
+    def remaining(self, now=None):
+        if self.deadline is None:
+            return 0.0
+        now = self.clock() if now is None else now
+        return max(0.0, self.deadline - now)
+
+    # Remaining time as shown: whole seconds, rounded up so a phase starts
+    # at its full length and ends at 00:00
+    def display(self, now=None):
+        return divmod(math.ceil(self.remaining(now)), 60)
+
+    # Seconds until the caller needs to wake up: when the displayed second
+    # changes if visible, otherwise at the next phase transition. None when
+    # reset, since nothing will happen until a phase is started
+    def next_wakeup(self, visible=True, now=None):
+        if self.deadline is None:
+            return None
+        left = self.remaining(now)
+        if visible and left > 0:
+            return left - (math.ceil(left) - 1)
+        return left
+
+    def _change(self, phase, t, deadline, now=None):
+        now = t if now is None else now
+        event = PhaseChange(phase, self.phase, t, time.time() - (now - t), deadline)
+        self.phase = phase
+        self.deadline = deadline
+        self.events.append(event)
+        return event
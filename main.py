@@ -1,18 +1,29 @@
 import datetime
-import threading
+import math
 import time
 import tkinter as tk
 import webbrowser
 from tkinter import ttk
 
-from backend.bai import analyze_eeg
-from backend.matplot import RealTimeBAIView
-from backend.timer import remaining
+from backend import instrument, lsl
+from backend.bai import ArtifactDetector, StreamingBAI
+from backend.metrics import MetricsStore
+from backend.normalize import ScoreNormalizer
+from backend.pipeline import BCIPipeline
+from backend.recorder import session_path
+from backend.timer import PomodoroTimer
+
+# Indices shown next to the BAI score, computed from the same band powers
+EXTRA_METRICS = {"engagement": "Engagement", "alpha_beta": "Alpha/Beta"}
 
 
 def main():
+    instrument.configure_from_env()
     app = Application()
-    app.mainloop()
+    try:
+        app.mainloop()
+    finally:
+        instrument.finish_from_env()
 
 
 class Application(tk.Tk):
@@ -26,6 +37,7 @@ class Application(tk.Tk):
         self.short_break_time = 5
         self.long_break_time = 15
         self.long_break_interval = 4
+        self.record_sessions = tk.BooleanVar(self, value=False)
 
         # Tabs
         self.notebook = ttk.Notebook(self)
@@ -48,13 +60,17 @@ class HomeTab(ttk.Frame):
         super().__init__(parent)
         self.app = app
 
+        self.timer = PomodoroTimer(app)
         self.timer_status = "Reset"
         self.bci_status = False
-        self.timer_remain_total_secs = 0
         self.timer_remain_mins = 0
         self.timer_remain_secs = 0
-        self.long_interval_count = 0
         self.timer_loop_id = None
+        self.bci_pipeline = None
+        self.bci_poll_id = None
+        self.bci_poll_due = None
+        self.score_normalizer = None
+        self.metrics_store = None
 
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
@@ -64,6 +80,17 @@ class HomeTab(ttk.Frame):
         self.draw_buttons()
         self.draw_info()
 
+        # The countdown only refreshes while visible, so catch up when shown
+        self.app.notebook.bind(
+            "<<NotebookTabChanged>>", lambda e: self.update_timer(), add="+"
+        )
+        # The root's bindings also see every child's <Map>, so filter on the root
+        self.app.bind(
+            "<Map>",
+            lambda e: self.update_timer() if e.widget is self.app else None,
+            add="+",
+        )
+
         if self.bci_status:
             self.matplot()
 
@@ -94,6 +121,12 @@ class HomeTab(ttk.Frame):
         self.focus_state_value = ttk.Label(self.info_frame, text="Score: ")
         self.focus_state_value.grid(row=1, column=1, padx=10, pady=5, sticky="ew")
 
+        self.metric_labels = {}
+        for i, (name, title) in enumerate(EXTRA_METRICS.items()):
+            label = ttk.Label(self.info_frame, text=f"{title}: ")
+            label.grid(row=2, column=i, padx=10, pady=5, sticky="ew")
+            self.metric_labels[name] = label
+
     def cancel_timer_loop(self):
         if self.timer_loop_id is not None:
             self.after_cancel(self.timer_loop_id)
@@ -147,127 +180,140 @@ class HomeTab(ttk.Frame):
             )
 
     def set_study(self):
-        self.cancel_timer_loop()
-        self.timer_status = "Study"
-        self.timer_remain_total_secs = 0
-        self.update_timer()
-        self.draw_buttons()
-        self.draw_info()
+        self.start_phase("Study")
 
     def set_short_break(self):
-        self.cancel_timer_loop()
-        self.timer_status = "Short Break"
-        self.timer_remain_total_secs = 0
-        self.update_timer()
-        self.draw_buttons()
-        self.draw_info()
+        self.start_phase("Short Break")
 
     def set_long_break(self):
-        self.cancel_timer_loop()
-        self.timer_status = "Long Break"
-        self.timer_remain_total_secs = 0
+        self.start_phase("Long Break")
+
+    def start_phase(self, phase):
+        self.phase_changed(self.timer.start(phase))
         self.update_timer()
         self.draw_buttons()
         self.draw_info()
 
     def reset(self):
         self.cancel_timer_loop()
-        self.timer_status = "Reset"
-        self.timer_remain_total_secs = 0
+        self.phase_changed(self.timer.reset())
         self.timer_remain_mins = 0
         self.timer_remain_secs = 0
-        self.long_interval_count = 0
         self.draw_buttons()
         self.draw_info()
 
+    # Refresh the countdown and sleep until the displayed second changes, or
+    # only until the phase ends while the Home tab is not visible
     def update_timer(self):
-        if self.timer_status == "Study":
-            if self.timer_remain_total_secs == 0:
-                self.timer_remain_total_secs = self.app.study_time * 60
-            (
-                self.timer_status,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            ) = remaining(
-                self.timer_status,
-                self.app.long_break_interval,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            )
-        elif self.timer_status == "Short Break":
-            if self.timer_remain_total_secs == 0:
-                self.timer_remain_total_secs = self.app.short_break_time * 60
-            (
-                self.timer_status,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            ) = remaining(
-                self.timer_status,
-                self.app.long_break_interval,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            )
-        elif self.timer_status == "Long Break":
-            if self.timer_remain_total_secs == 0:
-                self.timer_remain_total_secs = self.app.long_break_time * 60
-            (
-                self.timer_status,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            ) = remaining(
-                self.timer_status,
-                self.app.long_break_interval,
-                self.timer_remain_total_secs,
-                self.long_interval_count,
-            )
-        else:
-            return  # self.timer_status == "Reset" so the timer stops
-
-        self.timer_remain_mins, self.timer_remain_secs = divmod(
-            self.timer_remain_total_secs, 60
-        )
+        self.cancel_timer_loop()
+        events = self.timer.advance()
+        for event in events:
+            self.phase_changed(event)
+        if events:
+            self.draw_buttons()
+            self.timer_mode.config(text=f"Mode: {self.timer_status}")
+
+        self.timer_remain_mins, self.timer_remain_secs = self.timer.display()
         self.timer_time.config(
             text=f"Remaining: {self.timer_remain_mins:02}:{self.timer_remain_secs:02}"
         )
 
-        if self.timer_status != "Reset":
-            self.timer_loop_id = self.after(1000, self.update_timer)
+        delay = self.timer.next_wakeup(visible=self.winfo_viewable())
+        if delay is not None:
+            # A millisecond late so the display has already turned over
+            self.timer_loop_id = self.after(
+                math.ceil(delay * 1000) + 1, self.update_timer
+            )
+
+    # Stored metrics are grouped by the timer phase they were recorded in,
+    # from when the phase started rather than when the change was noticed
+    def phase_changed(self, event):
+        self.timer_status = event.phase
+        if self.metrics_store is not None:
+            self.metrics_store.set_phase(event.phase, event.wall)
 
     def start_bci(self):
         self.bci_status = True
 
-        def bci_loop():
-            while self.bci_status:
-                focus_state_value, focus_state = analyze_eeg()
-                self.after(0, self.update_bci_ui, focus_state_value, focus_state)
-                self.after(0, self.update_matplot, focus_state_value)
-                time.sleep(0.1)
-
-        if not hasattr(self, "bci_thread") or not self.bci_thread.is_alive():
-            self.bci_thread = threading.Thread(target=bci_loop, daemon=True)
-            self.bci_thread.start()
+        # Acquisition and analysis run on the pipeline's own threads
+        if self.bci_pipeline is None:
+            # Scores are relative to this user's saved calibration
+            self.score_normalizer = ScoreNormalizer.load()
+            self.bci_pipeline = BCIPipeline(
+                analyzer=StreamingBAI(
+                    normalizer=self.score_normalizer,
+                    metrics=EXTRA_METRICS,
+                    # Blinks and jaw clenches would otherwise read as focus shifts
+                    artifacts=ArtifactDetector(),
+                )
+            )
+        self.bci_pipeline.start()
+        if self.metrics_store is None:
+            self.metrics_store = MetricsStore()
+        self.metrics_store.start_session()
+        self.metrics_store.set_phase(self.timer_status)
+        if self.app.record_sessions.get():
+            lsl.start_recording(session_path())
+        if self.bci_poll_id is None:
+            self.schedule_poll(0)
 
         self.draw_buttons()
         self.draw_info()
 
     def stop_bci(self):
         self.bci_status = False
+        if self.bci_pipeline is not None:
+            self.bci_pipeline.stop(timeout=0)
+        lsl.stop_recording()
+        if self.score_normalizer is not None:
+            self.score_normalizer.save()
+        if self.metrics_store is not None:
+            self.metrics_store.end_session()
+        if self.bci_poll_id is not None:
+            self.after_cancel(self.bci_poll_id)
+            self.bci_poll_id = None
         self.draw_buttons()
         self.draw_info()
 
+    # Deliver pipeline results to the UI from the main thread
+    def poll_bci(self):
+        # How late Tk ran this callback, i.e. how busy the event loop is
+        instrument.record("tk_after_latency", time.monotonic() - self.bci_poll_due)
+        for update in self.bci_pipeline.poll():
+            state = update.state
+            if not self.score_normalizer.calibrated:
+                state = f"Calibrating ({state})"
+            self.update_bci_ui(update.value, state, update.metrics)
+            self.update_matplot(update.value, update.band_powers)
+            self.metrics_store.add(
+                update.value, update.state, update.band_powers, metrics=update.metrics
+            )
+        self.schedule_poll()
+
+    def schedule_poll(self, delay_ms=100):
+        self.bci_poll_due = time.monotonic() + delay_ms / 1000
+        self.bci_poll_id = self.after(delay_ms, self.poll_bci)
+
     # UI update must be done in the main thread
-    def update_bci_ui(self, focus_state_value, focus_state):
+    def update_bci_ui(self, focus_state_value, focus_state, metrics=None):
         print(f"Focus state: {focus_state_value} / 100 / {datetime.datetime.now()}")
         if self.bci_status:
             self.focus_state.config(text=f"State: {focus_state}")
             self.focus_state_value.config(text=f"Score: {focus_state_value} / 100")
+            for name, value in (metrics or {}).items():
+                title = EXTRA_METRICS[name]
+                self.metric_labels[name].config(text=f"{title}: {value:.2f}")
 
-    def update_matplot(self, focus_state_value):
+    @instrument.instrumented("update_matplot")
+    def update_matplot(self, focus_state_value, band_powers=None):
         if self.bci_status:
             if not hasattr(self, "bai_view") or self.bai_view is None:
+                # matplotlib is only loaded once there is something to plot
+                from backend.matplot import RealTimeBAIView
+
                 self.bai_view = RealTimeBAIView(self, update_ms=1000)
                 self.bai_view.grid(row=5, column=0, columnspan=4, sticky="nsew")
-            self.bai_view.update_bai(focus_state_value)
+            self.bai_view.update_bai(focus_state_value, band_powers)
 
 
 class SettingTab(ttk.Frame):
@@ -281,10 +327,10 @@ class SettingTab(ttk.Frame):
         self.draw_settings()
 
         ttk.Button(self, text="DAHCI", command=self.open_dahci).grid(
-            row=5, column=0, padx=10, pady=10, sticky="ew"
+            row=6, column=0, padx=10, pady=10, sticky="ew"
         )
         ttk.Button(self, text="GitHub", command=self.open_github).grid(
-            row=5, column=1, padx=10, pady=10, sticky="ew"
+            row=6, column=1, padx=10, pady=10, sticky="ew"
         )
 
     def draw_settings(self):
@@ -346,8 +392,13 @@ class SettingTab(ttk.Frame):
             row=3, column=1, padx=10, pady=10, sticky="ew"
         )
 
+        # Raw EEG goes to ~/.focustutor/sessions while BCI is running
+        ttk.Checkbutton(
+            self, text="Record EEG sessions", variable=self.app.record_sessions
+        ).grid(row=4, column=0, padx=10, pady=10, sticky="w", columnspan=2)
+
         ttk.Button(self, text="Reset to default", command=self.reset_to_default).grid(
-            row=4, column=0, padx=10, pady=10, sticky="ew", columnspan=2
+            row=5, column=0, padx=10, pady=10, sticky="ew", columnspan=2
         )
 
     def update_study_time(self):
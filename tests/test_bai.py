@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from backend.bai import (
+    ArtifactDetector,
+    SpectralEstimator,
+    StreamingBAI,
+    StreamingResampler,
+    apply_filter,
+    compute_bai,
+    compute_band_powers,
+    compute_channel_bai,
+    get_plan,
+    resample,
+    segment_epochs,
+)
+from backend.synthetic import SyntheticEEG
+
+FS = 256
+
+
+def run_streaming(data, dtype, estimator, aggregate):
+    analyzer = StreamingBAI(
+        FS,
+        plan=get_plan(FS, 1.0, estimator=estimator, dtype=dtype),
+        aggregate=aggregate,
+    )
+    updates = []
+    for start in range(0, data.shape[-1], FS // 4):
+        updates += analyzer.update(data[:, start : start + FS // 4])
+    values = np.array([np.asarray(update.value, float) for update in updates])
+    band_powers = np.array([update.band_powers for update in updates], float)
+    return values, band_powers
+
+
+def relative_error(actual, expected):
+    return np.max(np.abs(actual - expected) / np.abs(expected))
+
+
+# The float32 bounds quoted in the README
+@pytest.mark.parametrize("estimator", ["periodogram", "welch", "multitaper"])
+@pytest.mark.parametrize("aggregate, bai_bound", [("mean", 2e-5), (None, 4e-3)])
+def test_float32_matches_float64(estimator, aggregate, bai_bound):
+    for seed in range(30):
+        data = SyntheticEEG(FS, n_channels=5, seed=seed).generate(60 * FS).T
+        values64, powers64 = run_streaming(data, np.float64, estimator, aggregate)
+        values32, powers32 = run_streaming(data, np.float32, estimator, aggregate)
+        assert relative_error(powers32, powers64) < 1e-6
+        assert relative_error(values32, values64) < bai_bound
+
+
+def emg_noise(n_samples, seed=0):
+    t = np.arange(n_samples) / FS
+    freqs = np.arange(35, 50)[:, None]
+    phases = np.random.default_rng(seed).uniform(0, 2 * np.pi, freqs.shape)
+    return 5 * np.sin(2 * np.pi * freqs * t + phases).sum(axis=0)
+
+
+@pytest.mark.parametrize("estimator", ["periodogram", "welch", "multitaper"])
+def test_artifact_detector_keeps_beta_and_flags_emg(estimator):
+    plan = get_plan(FS, 1.0, estimator=estimator)
+    spectra = SpectralEstimator(plan)
+    detector = ArtifactDetector()
+    t = np.arange(FS) / FS
+    phases = np.linspace(0, 2 * np.pi, 8)[:, None]
+    for freq in (13.0, 20.0, 29.5, 30.0):
+        spectra.band_powers(20 * np.sin(2 * np.pi * freq * t + phases))
+        assert not detector.emg(spectra.power, plan.spectrum_freqs).any()
+
+    spectra.band_powers((20 * np.sin(2 * np.pi * 10 * t) + emg_noise(FS))[None])
+    assert detector.reject_spectrum(spectra.power, plan.spectrum_freqs).all()
+
+
+def test_emg_epochs_are_left_out():
+    data = SyntheticEEG(FS, n_channels=2, seed=0).generate(30 * FS).T
+    data[:, 10 * FS : 15 * FS] += emg_noise(5 * FS)
+    analyzer = StreamingBAI(FS, artifacts=ArtifactDetector())
+    analyzer.update(data)
+    assert 5 <= analyzer.rejected <= 6
+
+    bai_values, _ = compute_channel_bai(data, FS, artifacts=ArtifactDetector())
+    rejected = np.flatnonzero(np.isnan(bai_values).any(axis=0))
+    np.testing.assert_array_equal(rejected, np.arange(10, 15))
+
+
+# The in-place window arithmetic must match compute_bai bit for bit
+@pytest.mark.parametrize("chunk", [64, 100, 256, 1000])
+def test_streaming_matches_offline_reference(chunk):
+    data = SyntheticEEG(FS, n_channels=2, seed=1).generate(40 * FS).T
+    analyzer = StreamingBAI(FS, window_epochs=10, aggregate=None)
+    updates = []
+    for start in range(0, data.shape[-1], chunk):
+        updates += analyzer.update(data[:, start : start + chunk])
+
+    plan = get_plan(FS, 1.0)
+    epochs = segment_epochs(apply_filter(data, FS, mode="causal", plan=plan), FS, 1.0)
+    band_powers = compute_band_powers(epochs, FS, plan=plan)
+    assert len(updates) == band_powers.shape[-2] - 1
+    for end, update in enumerate(updates, start=2):
+        window = band_powers[:, max(0, end - 10) : end]
+        bai_values = compute_bai(*np.moveaxis(window, -1, 0), FS)
+        expected = [int(value) for value in np.mean(bai_values, axis=-1)]
+        assert update.value == expected
+        np.testing.assert_array_equal(update.band_powers, band_powers[:, end - 1])
+
+
+@pytest.mark.parametrize("fs_in", [512, 1000])
+@pytest.mark.parametrize("chunk", [1, 37, 256, 4096])
+def test_streaming_resampler_is_delayed_resample_poly(fs_in, chunk):
+    data = SyntheticEEG(fs_in, n_channels=2, seed=0).generate(10 * fs_in).T
+    resampler = StreamingResampler(fs_in, FS)
+    streamed = np.concatenate(
+        [
+            resampler.process(data[:, start : start + chunk])
+            for start in range(0, data.shape[-1], chunk)
+        ],
+        axis=-1,
+    )
+    whole = StreamingResampler(fs_in, FS).process(data)
+    np.testing.assert_array_equal(streamed, whole)
+
+    expected = resample(data, fs_in, FS)
+    assert streamed.shape == expected.shape
+    # The output lags by half_len samples; skip the edges, where resample_poly
+    # pads with zeros and the stream starts from its first sample
+    lag, edge = 10, 20
+    np.testing.assert_allclose(
+        streamed[:, edge + lag :], expected[:, edge:-lag], rtol=1e-12, atol=1e-9
+    )
@@ -0,0 +1,48 @@
+import io
+
+import numpy as np
+import pytest
+
+from backend import lsl
+from backend.bai import analyze_eeg
+from backend.batch import analyze_file, run_batch
+from backend.recorder import ReplayInlet
+from backend.synthetic import SyntheticInlet
+
+
+@pytest.fixture
+def inlet():
+    yield lambda source: lsl.set_inlet(source)
+    lsl.stop_recording()
+    lsl.set_inlet(None)
+
+
+# Recordings are scored at the analysis rate whatever rate they were made at
+@pytest.mark.parametrize("fs", [256, 512])
+def test_recording_reproduces_live_scores(inlet, tmp_path, fs):
+    path = str(tmp_path / "session.eeg")
+    inlet(SyntheticInlet(fs, n_channels=4, realtime=False, seed=3))
+    lsl.start_recording(path)
+    live = analyze_eeg(input_fs=fs)
+    lsl.stop_recording()
+
+    inlet(ReplayInlet(path, realtime=False))
+    assert analyze_eeg() == live
+
+    rows = analyze_file(path)
+    assert len(rows) == 10
+    bai_values = np.array([[row[-1] for row in rows]])
+    assert int(np.mean(np.nanmean(bai_values, axis=-1), axis=0)) == live[0]
+
+
+def test_short_recordings_are_reported_and_not_counted(tmp_path, capfd):
+    rng = np.random.default_rng(0)
+    np.save(tmp_path / "short.npy", rng.normal(size=(300, 4)))
+    np.save(tmp_path / "long.npy", rng.normal(size=(1024, 4)))
+    with pytest.raises(ValueError, match="too short"):
+        analyze_file(str(tmp_path / "short.npy"))
+
+    output = io.StringIO()
+    assert run_batch([str(tmp_path)], output, workers=1) == (1, 1, 4)
+    assert len(output.getvalue().splitlines()) == 5
+    assert "too short" in capfd.readouterr().err
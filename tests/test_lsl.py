@@ -0,0 +1,95 @@
+import numpy as np
+from pylsl import StreamInlet
+
+from backend import lsl
+from backend.lsl import EEGRingBuffer, StreamHealth
+from backend.recorder import read_recording
+from backend.synthetic import start_outlets
+
+
+def chunk(start, n, n_channels=3):
+    samples = np.arange(start, start + n, dtype=float)[:, None] * np.arange(
+        1, n_channels + 1
+    )
+    return samples, np.arange(start, start + n) / 256
+
+
+def test_ring_buffer_returns_latest_samples_in_order():
+    buffer = EEGRingBuffer(3, capacity=100)
+    written = 0
+    for n in (30, 50, 45, 1, 99, 7):
+        buffer.write(*chunk(written, n))
+        written += n
+        assert buffer.count == written
+
+        for want in (1, 20, 100, 500):
+            data, timestamps = buffer.latest(want)
+            got = min(want, written, 100)
+            expected, expected_timestamps = chunk(written - got, got)
+            np.testing.assert_array_equal(data, expected.T)
+            np.testing.assert_array_equal(timestamps, expected_timestamps)
+
+
+def test_ring_buffer_keeps_the_tail_of_an_oversized_chunk():
+    buffer = EEGRingBuffer(3, capacity=100)
+    buffer.write(*chunk(0, 40))
+    buffer.write(*chunk(40, 250))
+    assert buffer.count == 290
+    data, timestamps = buffer.latest(100)
+    expected, expected_timestamps = chunk(190, 100)
+    np.testing.assert_array_equal(data, expected.T)
+    np.testing.assert_array_equal(timestamps, expected_timestamps)
+
+
+def test_ring_buffer_latest_is_a_view():
+    buffer = EEGRingBuffer(3, capacity=100, dtype=np.float32)
+    buffer.write(*chunk(0, 150))
+    data, _ = buffer.latest(100)
+    assert data.dtype == np.float32
+    assert np.shares_memory(data, buffer._data)
+    assert buffer.latest(0)[0].shape == (3, 0)
+
+
+def test_real_stream_rate_and_samples(monkeypatch, tmp_path):
+    monkeypatch.setattr(lsl, "STREAM_NAME", "FocusTutorTest_eeg")
+    stop = start_outlets("FocusTutorTest_eeg", fs=512, seed=0)
+    try:
+        lsl.set_inlet(None)
+        assert isinstance(lsl.get_inlet(), StreamInlet)
+        assert lsl.get_stream_rate() == 512
+        lsl.start_recording(str(tmp_path / "session.eeg"))
+        assert lsl.get_raw_eeg(duration_sec=1.0).shape == (512,)
+    finally:
+        lsl.stop_recording()
+        lsl.set_inlet(None)
+        stop.set()
+    assert read_recording(str(tmp_path / "session.eeg"))[1] == 512
+
+
+def test_stream_health_fills_short_gaps_between_chunks():
+    health = StreamHealth(fs=256)
+    health.check(*chunk(0, 100))
+    samples, timestamps = health.check(*chunk(110, 90))
+    expected, expected_timestamps = chunk(100, 100)
+    np.testing.assert_allclose(samples, expected)
+    np.testing.assert_allclose(timestamps, expected_timestamps)
+    assert (health.gaps, health.filled_samples, health.breaks()) == (1, 10, 0)
+
+
+def test_stream_health_ignores_a_late_sample():
+    health = StreamHealth(fs=256)
+    samples, timestamps = chunk(0, 100)
+    timestamps[50] += 0.6 / 256  # Late, so the next interval looks too long
+    checked, _ = health.check(samples, timestamps)
+    assert len(checked) == 100
+    assert health.filled_samples == 0
+
+
+def test_stream_health_counts_long_gaps_and_reconnects_as_breaks():
+    health = StreamHealth(fs=256, max_fill_s=0.25)
+    health.check(*chunk(0, 100))
+    samples, _ = health.check(*chunk(100 + 256, 100))
+    assert len(samples) == 100
+    assert (health.dropouts, health.filled_samples, health.breaks()) == (1, 0, 1)
+    health.reconnects += 1
+    assert health.breaks() == 2
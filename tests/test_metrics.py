@@ -0,0 +1,53 @@
+import pytest
+
+from backend.metrics import DAY_S, MetricsStore
+
+NOW = 1_800_000_000.0
+
+
+@pytest.fixture
+def store():
+    store = MetricsStore(":memory:", batch_size=3)
+    yield store
+    store.close()
+
+
+def add_block(store, phase, t, values):
+    store.set_phase(phase, t=t)
+    for i, value in enumerate(values):
+        store.add(value, "High", (1.0, 2.0, 3.0, 4.0), t=t + i, metrics={"x": i})
+
+
+def test_block_totals_match_the_metric_rows(store):
+    store.start_session(t=NOW)
+    add_block(store, "Study", NOW, [10, 20, 30, 40, 50])
+    add_block(store, "Short Break", NOW + 100, [5])
+    add_block(store, "Study", NOW + 200, [70, 80])
+    store.end_session(t=NOW + 300)
+
+    blocks = store.focus_per_block("Study", now=NOW + 300)
+    assert [(n, mean) for *_, n, mean in blocks] == [(5, 30.0), (2, 75.0)]
+    assert blocks[0][3] == NOW + 100  # Ended when the break started
+    assert store.mean_focus("Study", now=NOW + 300) == pytest.approx(300 / 7)
+    assert store.mean_focus("Short Break", now=NOW + 300) == 5.0
+
+    session_id = blocks[0][1]
+    rows = store.session_metrics(session_id, "Study")
+    assert [row[4] for row in rows] == [10, 20, 30, 40, 50, 70, 80]
+
+
+def test_pending_values_count_before_a_flush(store):
+    store.start_session(t=NOW)
+    add_block(store, "Study", NOW, [1, 2])  # Below batch_size, still pending
+    assert store.mean_focus("Study", now=NOW) == 1.5
+
+
+def test_old_blocks_and_values_outside_sessions_are_left_out(store):
+    store.add(99, "High", t=NOW)  # No session yet
+    store.start_session(t=NOW - 100 * DAY_S)
+    add_block(store, "Study", NOW - 100 * DAY_S, [10])
+    store.start_session(t=NOW)
+    store.set_phase("Study", t=NOW)
+    store.add(30, "High", t=NOW)
+    assert store.mean_focus("Study", days=90, now=NOW) == 30.0
+    assert len(store.focus_per_block("Study", days=365, now=NOW)) == 2
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from backend.normalize import ScoreNormalizer
+
+
+def test_calibration_matches_plain_statistics():
+    values = 10 ** np.random.default_rng(0).normal(-1.0, 0.3, 60)
+    normalizer = ScoreNormalizer(calibration_updates=60)
+    for value in values[:-1]:
+        normalizer.update(value)
+    assert not normalizer.calibrated
+    normalizer.update(values[-1])
+    assert normalizer.calibrated
+    assert normalizer.mean == pytest.approx(np.mean(np.log10(values)))
+    assert normalizer.var == pytest.approx(np.var(np.log10(values)))
+
+
+def test_normalized_values_follow_the_users_scale():
+    normalizer = ScoreNormalizer(calibration_updates=10)
+    assert normalizer.normalize(0.1) == 0.5  # Nothing to compare against yet
+    for value in 10 ** np.linspace(-2, 0, 10):
+        normalizer.update(value)
+    typical = 10**normalizer.mean
+    assert normalizer.normalize(typical, update=False) == pytest.approx(0.5)
+    assert normalizer.normalize(typical * 10, update=False) > 0.9
+    assert normalizer.normalize(typical / 10, update=False) < 0.1
+    assert normalizer.normalize(0) == pytest.approx(0)  # Clamped, not a log error
+
+
+def test_statistics_adapt_to_drift_after_calibration():
+    normalizer = ScoreNormalizer(calibration_updates=10, halflife=20)
+    for _ in range(5):
+        normalizer.update(0.01)
+        normalizer.update(0.1)
+    for _ in range(20):
+        normalizer.update(1.0)
+    # Half of the way from the calibrated mean of -1.5 towards 0
+    assert normalizer.mean == pytest.approx(-0.75)
+
+
+def test_calibration_is_saved_and_restored(tmp_path):
+    path = tmp_path / "profile" / "calibration.json"
+    normalizer = ScoreNormalizer.load(path, calibration_updates=4)
+    assert normalizer.count == 0
+    for value in [0.1, 0.2, 0.3]:
+        normalizer.update(value)
+    assert not path.exists()
+    normalizer.update(0.4)
+    assert path.exists()  # Saved as soon as calibration finishes
+
+    restored = ScoreNormalizer.load(path)
+    assert restored.to_dict() == normalizer.to_dict()
+    assert restored.calibrated
+    assert restored.normalize(0.25, update=False) == normalizer.normalize(
+        0.25, update=False
+    )
+
+
+def test_unreadable_profile_starts_a_new_calibration(tmp_path):
+    path = tmp_path / "calibration.json"
+    path.write_text("not json")
+    normalizer = ScoreNormalizer.load(path, calibration_updates=5)
+    assert normalizer.count == 0 and not normalizer.calibrated
+    assert normalizer.calibration_updates == 5
@@ -0,0 +1,40 @@
+import threading
+
+from backend.pipeline import BoundedQueue
+
+
+def fill(queue, n):
+    return [queue.put(i, timeout=0) for i in range(n)]
+
+
+def test_drop_oldest_keeps_the_newest_items():
+    queue = BoundedQueue(3, "drop_oldest")
+    assert fill(queue, 5) == [True] * 5
+    assert queue.drain() == [2, 3, 4]
+    assert queue.stats() == {"depth": 0, "max_depth": 3, "put": 5, "dropped": 2}
+
+
+def test_drop_newest_keeps_the_oldest_items():
+    queue = BoundedQueue(3, "drop_newest")
+    assert fill(queue, 5) == [True, True, True, False, False]
+    assert queue.drain() == [0, 1, 2]
+    assert queue.stats()["dropped"] == 2
+
+
+def test_block_waits_for_room():
+    queue = BoundedQueue(1, "block")
+    queue.put("first")
+    assert not queue.put("dropped", timeout=0.01)
+
+    threading.Timer(0.05, queue.get).start()
+    assert queue.put("second", timeout=5)
+    assert queue.drain() == ["second"]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_get_times_out_on_an_empty_queue():
+    queue = BoundedQueue(2)
+    assert queue.get(timeout=0.01) is None
+    queue.put("item")
+    assert queue.get(timeout=0) == "item"
+    assert len(queue) == 0
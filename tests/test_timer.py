@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backend.timer import PomodoroTimer
+
+SETTINGS = SimpleNamespace(
+    study_time=25, short_break_time=5, long_break_time=15, long_break_interval=2
+)
+
+
+def test_advance_runs_every_missed_transition_from_its_deadline():
+    timer = PomodoroTimer(SETTINGS)
+    timer.start("Study", now=0.0)
+    assert timer.advance(now=25 * 60 - 1) == []
+
+    # Woken up late: study ends at 25 min, the break at 30, study again at 55
+    events = timer.advance(now=56 * 60)
+    assert [(e.phase, e.t, e.deadline) for e in events] == [
+        ("Short Break", 25 * 60, 30 * 60),
+        ("Study", 30 * 60, 55 * 60),
+        ("Long Break", 55 * 60, 70 * 60),
+    ]
+    assert timer.remaining(now=56 * 60) == 14 * 60
+    assert timer.display(now=56 * 60) == (14, 0)
+
+
+def test_reset_stops_the_timer():
+    timer = PomodoroTimer(SETTINGS)
+    timer.start("Study", now=0.0)
+    timer.advance(now=25 * 60)
+    timer.reset(now=26 * 60)
+    assert (timer.phase, timer.deadline, timer.long_interval_count) == (
+        "Reset",
+        None,
+        0,
+    )
+    assert timer.advance(now=100 * 60) == []
+    assert timer.next_wakeup(now=100 * 60) is None
+
+
+@pytest.mark.parametrize(
+    "now, visible, wakeup",
+    [
+        (0.0, True, 1.0),  # Shows 25:00 until a second has passed
+        (0.25, True, 0.75),
+        (10.5, True, 0.5),
+        (0.25, False, 25 * 60 - 0.25),  # Hidden: only the deadline matters
+        (25 * 60 - 0.5, True, 0.5),
+    ],
+)
+def test_next_wakeup(now, visible, wakeup):
+    timer = PomodoroTimer(SETTINGS)
+    timer.start("Study", now=0.0)
+    assert timer.next_wakeup(visible, now=now) == pytest.approx(wakeup)